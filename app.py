@@ -1,9 +1,11 @@
 import os
+import threading
 import random
 import string
 import shutil
 import traceback
 import logging
+from collections import defaultdict
 from datetime import datetime
 from flask import Flask, request, send_from_directory, jsonify, Blueprint
 from flask_sqlalchemy import SQLAlchemy
@@ -11,7 +13,13 @@ from flask_cors import CORS
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 
-from utils.cv_processing import process_and_store_embeddings, delete_cv_data
+from utils.cv_processing import delete_cv_data
+from utils.ingest_queue import start_ingest_workers, enqueue_job, get_job
+from utils.content_cache import save_upload
+from utils.upload_stream import StreamingUploadRequest, spool_upload, remove_partial_uploads
+from utils.db import DATABASE_URI, add_missing_columns, engine_options
+from utils.cv_listing import list_cvs, parse_list_options
+from utils.extraction import warm_up_extraction_pool
 from utils.retriever import retrieve_similar_chunks, expand_query_with_keywords
 from utils.llm import build_prompt, query_with_openai_sdk, normalize_llm_response
 
@@ -28,6 +36,8 @@ logger = logging.getLogger(__name__)
 
 # ───── Flask Setup ─────
 app = Flask(__name__)
+# Uploads are streamed by the multipart parser into the upload folder (CVs) or memory
+app.request_class = StreamingUploadRequest
 CORS(app)
 
 @app.before_request
@@ -42,12 +52,15 @@ ALLOWED_EXTENSIONS = {'pdf', 'docx'}
 app.config.update({
     'UPLOAD_FOLDER': UPLOAD_FOLDER,
     'MAX_CONTENT_LENGTH': 70 * 1024 * 1024,
-    'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(basedir, 'cv_uploads.db'),
+    'DISK_UPLOAD_ENDPOINTS': {'api.upload_cv'},
+    'SQLALCHEMY_DATABASE_URI': DATABASE_URI,  # cv_uploads.db unless DATABASE_URI is set
+    'SQLALCHEMY_ENGINE_OPTIONS': engine_options(DATABASE_URI),
     'SECRET_KEY': os.getenv('FLASK_SECRET_KEY', 'fallback-insecure-key'),
 })
 
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
+remove_partial_uploads(UPLOAD_FOLDER)
 
 # ───── Database ─────
 db = SQLAlchemy(app)
@@ -71,10 +84,17 @@ class UploadedCV(db.Model):
     original_filename = db.Column(db.String(255))
     stored_filename = db.Column(db.String(255), unique=True)
     filepath = db.Column(db.String(255))
-    upload_time = db.Column(db.DateTime, default=datetime.utcnow)
-    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
+    upload_time = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False, index=True)
     comment = db.Column(db.Text, nullable=True)
     commented_at = db.Column(db.DateTime, nullable=True)
+    content_hash = db.Column(db.String(64), nullable=True, index=True)  # sha256 of the file bytes
+
+    # Keyset pagination of /api/cvs, newest first, optionally within a group
+    __table_args__ = (
+        db.Index("ix_uploaded_cv_upload_time_id", "upload_time", "id"),
+        db.Index("ix_uploaded_cv_group_upload_time_id", "group_id", "upload_time", "id"),
+    )
 
     def as_dict(self):
         return {
@@ -85,7 +105,8 @@ class UploadedCV(db.Model):
             "upload_time": self.upload_time.isoformat(),
             "group": self.group_rel.name if self.group_rel else None,
             "comment": self.comment,
-            "commented_at": self.commented_at.isoformat() if self.commented_at else None
+            "commented_at": self.commented_at.isoformat() if self.commented_at else None,
+            "content_hash": self.content_hash
         }
 
 # ───── Utils ─────
@@ -95,6 +116,29 @@ def allowed_file(filename):
 def generate_unique_id(length=5):
     return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
 
+def remove_failed_upload(stored_filename):
+    """
+    Called by the ingestion workers when a CV could not be processed.
+    """
+    with app.app_context():
+        cv = UploadedCV.query.filter_by(stored_filename=stored_filename).first()
+        if not cv:
+            return
+        if os.path.exists(cv.filepath):
+            os.remove(cv.filepath)
+        db.session.delete(cv)
+        db.session.commit()
+
+def existing_uploads(stored_filenames):
+    """
+    Called by the ingestion workers before indexing: the CVs of a job that were not deleted meanwhile.
+    """
+    with app.app_context():
+        return {
+            name for (name,) in db.session.query(UploadedCV.stored_filename)
+            .filter(UploadedCV.stored_filename.in_(stored_filenames))
+        }
+
 # ───── Blueprint ─────
 api = Blueprint('api', __name__)
 
@@ -160,37 +204,108 @@ def upload_cv():
             db.session.add(group_obj)
             db.session.commit()
 
-        uploaded_files, errors = [], []
+        uploaded_files, duplicates, errors, saved = [], [], [], []
+        duplicate_of = {}  # stored_filename -> stored_filename of the existing copy in another group
 
+        # Each file is already on disk in the upload folder, hashed while the body was read
+        incoming = []
         for file in files:
+            if file and allowed_file(file.filename):
+                spool = spool_upload(file.stream, app.config['UPLOAD_FOLDER'])
+                incoming.append((file.filename, spool, spool.sha256))
+            else:
+                errors.append({"filename": file.filename, "error": "Invalid file type"})
+
+        # Same bytes already uploaded: skip within the group, reuse file and vectors across groups.
+        # One lookup for all files; copies saved earlier in this request count as well.
+        existing_by_hash = defaultdict(list)
+        if incoming:
+            for cv in UploadedCV.query.filter(
+                UploadedCV.content_hash.in_({content_hash for _, _, content_hash in incoming})
+            ).order_by(UploadedCV.id):
+                existing_by_hash[cv.content_hash].append(cv)
+
+        for filename, spool, content_hash in incoming:
             try:
-                if file and allowed_file(file.filename):
-                    unique_filename = f"{generate_unique_id()}_{secure_filename(file.filename)}"
-                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-                    file.save(filepath)
-
-                    uploaded = UploadedCV(
-                        original_filename=file.filename,
-                        stored_filename=unique_filename,
-                        filepath=filepath,
-                        group_id=group_obj.id
-                    )
-                    db.session.add(uploaded)
-                    db.session.commit()
-
-                    process_and_store_embeddings(filepath, file.filename, unique_filename, group_obj.name)
-                    uploaded_files.append(uploaded.as_dict())
-                else:
-                    errors.append({"filename": file.filename, "error": "Invalid file type"})
+                existing = existing_by_hash[content_hash]
+                same_group = next((cv for cv in existing if cv.group_id == group_obj.id), None)
+                if same_group:
+                    duplicates.append((filename, same_group))
+                    spool.close()
+                    continue
+
+                unique_filename = f"{generate_unique_id()}_{secure_filename(filename)}"
+                filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+                save_upload(spool, filepath, existing[0].filepath if existing else None)
+
+                uploaded = UploadedCV(
+                    original_filename=filename,
+                    stored_filename=unique_filename,
+                    filepath=filepath,
+                    group_id=group_obj.id,
+                    content_hash=content_hash
+                )
+                saved.append(uploaded)
+                if existing:
+                    duplicate_of[unique_filename] = existing[0].stored_filename
+                existing.append(uploaded)
             except Exception as inner_e:
-                logger.error("Error processing file %s: %s", file.filename, traceback.format_exc())
-                errors.append({"filename": file.filename, "error": str(inner_e)})
+                logger.error("Error processing file %s: %s", filename, traceback.format_exc())
+                errors.append({"filename": filename, "error": str(inner_e)})
 
-        return jsonify({"uploaded": uploaded_files, "errors": errors}), 200
+        # All rows of the upload in one transaction; flushed first so ids are known before the commit
+        try:
+            db.session.add_all(saved)
+            db.session.flush()
+            duplicates = [{"filename": filename, "duplicate_of": cv.as_dict()} for filename, cv in duplicates]
+            for uploaded in saved:
+                uploaded_file = uploaded.as_dict()
+                if uploaded.stored_filename in duplicate_of:
+                    uploaded_file["duplicate_of"] = duplicate_of[uploaded.stored_filename]
+                uploaded_files.append(uploaded_file)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            for uploaded in saved:
+                if os.path.exists(uploaded.filepath):
+                    os.remove(uploaded.filepath)
+            raise
+
+        if not saved:
+            return jsonify({"uploaded": [], "duplicates": duplicates, "errors": errors}), 200
+
+        # Extraction + embedding run in the background ingestion workers
+        job_id = enqueue_job(group_obj.name, [
+            {
+                "original_filename": uploaded.original_filename,
+                "stored_filename": uploaded.stored_filename,
+                "filepath": uploaded.filepath,
+                "content_hash": uploaded.content_hash
+            } for uploaded in saved
+        ])
+
+        return jsonify({
+            "job_id": job_id,
+            "status_url": f"/api/jobs/{job_id}",
+            "uploaded": uploaded_files,
+            "duplicates": duplicates,
+            "errors": errors
+        }), 202
     except Exception as e:
         logger.error("Error in /upload_cv: %s", traceback.format_exc())
         return jsonify({"error": str(e)}), 500
 
+@api.route("/jobs/<job_id>", methods=["GET"])
+def get_job_status(job_id):
+    try:
+        job = get_job(job_id)
+        if job is None:
+            return jsonify({"error": f"Job '{job_id}' not found"}), 404
+        return jsonify(job), 200
+    except Exception as e:
+        logger.error("Error in /jobs/<id> GET: %s", traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
+
 @api.route("/cv/<int:cv_id>/comment", methods=["POST"])
 def add_or_update_comment(cv_id):
     try:
@@ -226,16 +341,18 @@ def get_cvs():
     try:
         data = request.get_json() or {}
         group_name = data.get("group")
-
         if not group_name or str(group_name).lower() in ["null", "undefined", ""]:
-            uploads = UploadedCV.query.order_by(UploadedCV.upload_time.desc()).all()
-        else:
-            group_obj = Group.query.filter_by(name=group_name).first()
-            if not group_obj:
-                return jsonify([]), 200
-            uploads = UploadedCV.query.filter_by(group_id=group_obj.id).order_by(UploadedCV.upload_time.desc()).all()
-
-        return jsonify([upload.as_dict() for upload in uploads]), 200
+            group_name = None
+
+        try:
+            options, paginated = parse_list_options(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        items, next_cursor = list_cvs(db.session, UploadedCV.__table__, Group.__table__, group_name, **options)
+        if paginated:
+            return jsonify({"items": items, "next_cursor": next_cursor}), 200
+        return jsonify(items), 200
     except Exception as e:
         logger.error("Error in /cvs POST: %s", traceback.format_exc())
         return jsonify({"error": str(e)}), 500
@@ -249,9 +366,11 @@ def delete(cv_id):
         except Exception as e:
             logger.warning("File deletion failed: %s", e)
 
-        delete_cv_data(cv.stored_filename, group=cv.group_rel.name)
+        # The row goes first: an ingestion job still running for this CV then skips it
+        stored_filename, group_name = cv.stored_filename, cv.group_rel.name
         db.session.delete(cv)
         db.session.commit()
+        delete_cv_data(stored_filename, group=group_name)
 
         return jsonify({"message": f"Deleted '{cv.original_filename}'"}), 200
     except Exception as e:
@@ -268,8 +387,37 @@ def uploaded_file(filename):
 
 # ───── App Runner ─────
 app.register_blueprint(api, url_prefix='/api')
+with app.app_context():
+    # Columns added since the tables were first created
+    add_missing_columns(UploadedCV.__table__, db.engine)
+
+_workers_started = False
+_workers_lock = threading.Lock()
+
+def start_background_workers():
+    """
+    Start the text extraction processes and the ingestion workers of this process. Called by
+    the server once per worker process (gunicorn.conf.py, or the dev server below) rather than
+    on import, so tooling and the reloader's watcher process do not start them.
+    """
+    global _workers_started
+    with _workers_lock:
+        if _workers_started:
+            return
+        warm_up_extraction_pool()
+        start_ingest_workers(on_file_failed=remove_failed_upload, existing_files=existing_uploads)
+        _workers_started = True
+
+@app.before_request
+def ensure_background_workers():
+    # Servers without a startup hook (e.g. `flask run`) start them on the first request
+    if not _workers_started:
+        start_background_workers()
 
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+    # With the reloader, the app is served by a child process started with WERKZEUG_RUN_MAIN
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_workers()
     app.run(host='0.0.0.0', port=5001, debug=True)
@@ -1,89 +1,897 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse
+# Async (FastAPI) variant of main.py, with the same /api routes:
+#   uvicorn fastmain:app --host 0.0.0.0 --port 5001 --workers 2
+# Database access goes through an async SQLAlchemy engine, LLM calls through the async OpenAI
+# client, and retrieval, extraction and index writes run in the default thread pool, so the
+# event loop keeps serving other requests while they (and the LLM) are in flight.
+import os
+import io
+import json
+import random
+import string
+import shutil
+import asyncio
+import zipfile
+import logging
+import traceback
+from contextlib import asynccontextmanager
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Optional
+from zoneinfo import ZoneInfo  # native in Python 3.9+
+
+from dotenv import load_dotenv
+from fastapi import FastAPI, APIRouter, Depends, UploadFile, File, Form
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-import os, shutil, uuid, random, string, traceback, asyncio
-from typing import List
+from sqlalchemy import Integer, String, Text, DateTime, ForeignKey, Index, select, delete as sql_delete, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+from werkzeug.security import safe_join
+from werkzeug.utils import secure_filename
+
+load_dotenv()
+
+from utils.cv_processing import delete_cv_data
+from utils.extraction import extract_text, extract_texts, warm_up_extraction_pool
+from utils.retriever import retrieve_for_prompt, retrieve_for_prompt_batch, get_index_version
+from utils.llm import (
+    build_prompt, build_prompt_with_stats, async_query_with_openai_sdk, async_stream_query_with_openai_sdk,
+    normalize_llm_response, CandidateStreamParser
+)
+from utils.index_cache import clear_index_cache
+from utils.index_factory import parse_search_options
+from utils.query_cache import async_get_llm_answer, peek_llm_answer, store_llm_answer, clear_query_caches
+from utils.chunk_store import delete_all_chunks
+from utils.ingest_queue import start_ingest_workers, enqueue_job, get_job
+from utils.content_cache import save_upload
+from utils.upload_stream import spool_upload, remove_partial_uploads
+from utils.db import engine as sync_engine, add_missing_columns, create_async_db_engine
+from utils.cv_listing import list_cvs, parse_list_options
+from utils.group_cache import GroupMap
+
+logger = logging.getLogger(__name__)
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+UPLOAD_FOLDER = os.path.join(basedir, 'uploaded_cvs')
+ALLOWED_EXTENSIONS = {'pdf', 'docx'}
+# Max JDs per /upload_jd/batch request (files plus zip members), and max size of one zip member
+JD_BATCH_MAX_FILES = int(os.getenv("JD_BATCH_MAX_FILES", 100))
+JD_BATCH_MAX_FILE_BYTES = 20 * 1024 * 1024
+# Threads for blocking work (retrieval, extraction, index writes) of all in-flight requests
+ASYNC_WORKER_THREADS = int(os.getenv("ASYNC_WORKER_THREADS", 64))
+
+
+# ───── Models ─────
+# Same tables as the Flask-SQLAlchemy models of main.py
+class Base(DeclarativeBase):
+    pass
+
+class Group(Base):
+    __tablename__ = "group"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    name: Mapped[str] = mapped_column(String(255), unique=True, nullable=False)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "created_at": self.created_at.isoformat()
+        }
+
+class UploadedCV(Base):
+    __tablename__ = "uploaded_cv"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    original_filename: Mapped[Optional[str]] = mapped_column(String(255))
+    stored_filename: Mapped[Optional[str]] = mapped_column(String(255), unique=True)
+    filepath: Mapped[Optional[str]] = mapped_column(String(255))
+    upload_time: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+    group_id: Mapped[int] = mapped_column(Integer, ForeignKey('group.id'), nullable=False, index=True)
+    comment: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    commented_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    content_hash: Mapped[Optional[str]] = mapped_column(String(64), nullable=True, index=True)  # sha256 of the file bytes
+    # Loaded with the CV in the same query, lazy loads are not possible in async code
+    group_rel: Mapped[Group] = relationship(Group, lazy="joined")
+
+    # Keyset pagination of /api/cvs, newest first, optionally within a group
+    __table_args__ = (
+        Index("ix_uploaded_cv_upload_time_id", "upload_time", "id"),
+        Index("ix_uploaded_cv_group_upload_time_id", "group_id", "upload_time", "id"),
+    )
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "original_filename": self.original_filename,
+            "stored_filename": self.stored_filename,
+            "filepath": self.filepath,
+            "upload_time": self.upload_time.isoformat(),
+            "group": self.group_rel.name if self.group_rel else None,
+            "comment": self.comment,
+            "commented_at": self.commented_at.isoformat() if self.commented_at else None,
+            "content_hash": self.content_hash
+        }
+
 
-from utils.retriever import retrieve_similar_chunks
-from utils.cv_processing import process_and_store_embeddings, delete_cv_data
-from utils.llm import build_prompt, async_query_with_together_sdk
+# ───── Database ─────
+engine = create_async_db_engine()
+Session = async_sessionmaker(engine, expire_on_commit=False)
 
-app = FastAPI()
-UPLOAD_FOLDER = "uploaded_cvs"
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+async def get_session():
+    async with Session() as session:
+        yield session
 
-# Allow CORS
+def load_groups():
+    with sync_engine.connect() as conn:
+        return conn.execute(select(Group.name, Group.id)).all()
+
+# Group name -> id, shared by the requests of this worker. Reloads hit the database, so
+# lookups run in the thread pool.
+group_map = GroupMap(load_groups)
+
+async def get_group_id(name):
+    return await asyncio.to_thread(group_map.get_id, name)
+
+async def get_or_create_group(session, name):
+    """
+    Return the group called `name`, creating it if needed, in the session's transaction, so
+    that rows written with its id in that transaction never point to a group deleted meanwhile
+    (group_map may be up to GROUP_CACHE_TTL stale).
+    """
+    group = await session.scalar(select(Group).where(Group.name == name))
+    if group is None:
+        group = Group(name=name)
+        session.add(group)
+        try:
+            await session.flush()
+        except IntegrityError:
+            # Created by another worker in the meantime
+            await session.rollback()
+            group = (await session.scalars(select(Group).where(Group.name == name))).one()
+        group_map.invalidate()
+    return group
+
+
+# ───── Utils ─────
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+def generate_unique_id(length=5):
+    return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
+
+def error(message, status_code, **details):
+    return JSONResponse({"error": message, **details}, status_code=status_code)
+
+def is_unset(group_name):
+    return not group_name or str(group_name).lower() in ["null", "undefined", ""]
+
+def remove_failed_upload(stored_filename):
+    """
+    Called by the ingestion workers (threads) when a CV could not be processed.
+    """
+    with sync_engine.begin() as conn:
+        filepath = conn.execute(
+            select(UploadedCV.filepath).where(UploadedCV.stored_filename == stored_filename)
+        ).scalar()
+        if filepath is None:
+            return
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        conn.execute(sql_delete(UploadedCV).where(UploadedCV.stored_filename == stored_filename))
+
+def existing_uploads(stored_filenames):
+    """
+    Called by the ingestion workers before indexing: the CVs of a job that were not deleted meanwhile.
+    """
+    with sync_engine.connect() as conn:
+        return set(conn.execute(
+            select(UploadedCV.stored_filename).where(UploadedCV.stored_filename.in_(stored_filenames))
+        ).scalars())
+
+
+# ───── App ─────
+@asynccontextmanager
+async def lifespan(app):
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=ASYNC_WORKER_THREADS, thread_name_prefix="blocking")
+    )
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    remove_partial_uploads(UPLOAD_FOLDER)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    # Columns added since the tables were first created
+    await asyncio.to_thread(add_missing_columns, UploadedCV.__table__)
+    # Start the text extraction worker processes before the first upload
+    await asyncio.to_thread(warm_up_extraction_pool)
+    start_ingest_workers(on_file_failed=remove_failed_upload, existing_files=existing_uploads)
+    yield
+    await engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], allow_credentials=True,
     allow_methods=["*"], allow_headers=["*"],
 )
+api = APIRouter(prefix="/api")
 
+@api.get("/")
+async def index():
+    return {"message": "Welcome to the Resume Analyzer API"}
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in {"pdf", "docx"}
+# ───── Group APIs ─────
+@api.get("/groups")
+async def list_groups(session: AsyncSession = Depends(get_session)):
+    groups = (await session.scalars(select(Group))).all()
+    return [g.as_dict() for g in groups]
 
+@api.post("/groups")
+async def create_group(data: dict, session: AsyncSession = Depends(get_session)):
+    name = data.get("name")
+    if not name:
+        return error("Group name required", 400)
+    if await get_group_id(name) is not None:
+        return error("Group already exists", 400)
+    new_group = Group(name=name)
+    session.add(new_group)
+    await session.commit()
+    group_map.invalidate()
+    return JSONResponse(new_group.as_dict(), status_code=201)
 
-def generate_unique_id(length=5):
-    return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
+@api.delete("/groups/{group_id}")
+async def delete_group(group_id: int, session: AsyncSession = Depends(get_session)):
+    group = await session.get(Group, group_id)
+    if group is None:
+        return error(f"Group {group_id} not found", 404)
+    cv_count = await session.scalar(select(func.count()).select_from(UploadedCV).where(UploadedCV.group_id == group_id))
+    if cv_count:
+        return error("Cannot delete group with CVs linked to it.", 400)
+    await session.delete(group)
+    await session.commit()
+    group_map.invalidate()
+    return {"message": f"Group '{group.name}' deleted."}
 
+# ───── CV Upload API ─────
+@api.post("/upload_cv")
+async def upload_cv(
+    cv: List[UploadFile] = File(None),
+    group: Optional[str] = Form(None),
+    session: AsyncSession = Depends(get_session)
+):
+    try:
+        if not cv:
+            return error("No files selected.", 400)
+        if not group:
+            return error("No group selected.", 400)
 
-@app.post("/upload_cv")
-async def upload_cv(cv: List[UploadFile] = File(...), group: str = Form("general")):
-    uploaded_files = []
-    errors = []
+        group_obj = await get_or_create_group(session, group)
 
-    for file in cv:
-        if file.filename and allowed_file(file.filename):
-            original_filename = file.filename
-            unique_id = generate_unique_id()
-            stored_filename = f"{unique_id}_{original_filename}"
-            file_path = os.path.join(UPLOAD_FOLDER, stored_filename)
+        uploaded_files = []
+        duplicates = []  # (filename, UploadedCV it duplicates)
+        errors = []
+        saved = []
+        duplicate_of = {}  # stored_filename -> stored_filename of the existing copy in another group
 
-            with open(file_path, "wb") as f:
-                shutil.copyfileobj(file.file, f)
+        # Copied chunk by chunk from the parser's spool into the upload folder, hashed on the way
+        incoming = []
+        for file in cv:
+            if file.filename and allowed_file(file.filename):
+                spool = await asyncio.to_thread(spool_upload, file.file, UPLOAD_FOLDER)
+                incoming.append((file.filename, spool, spool.sha256))
+            else:
+                errors.append({"filename": file.filename, "error": "Invalid file type"})
 
-            # Process embedding
-            await asyncio.to_thread(process_and_store_embeddings, file_path, original_filename, stored_filename, group)
+        # Same bytes already uploaded: skip within the group, reuse file and vectors across groups.
+        # One lookup for all files; copies saved earlier in this request count as well.
+        existing_by_hash = defaultdict(list)
+        if incoming:
+            for existing_cv in await session.scalars(
+                select(UploadedCV)
+                .where(UploadedCV.content_hash.in_({content_hash for _, _, content_hash in incoming}))
+                .order_by(UploadedCV.id)
+            ):
+                existing_by_hash[existing_cv.content_hash].append(existing_cv)
 
-            uploaded_files.append({
-                "original_filename": original_filename,
-                "stored_filename": stored_filename,
-                "group": group
-            })
-        else:
-            errors.append({"filename": file.filename, "error": "Invalid file type"})
+        for filename, spool, content_hash in incoming:
+            existing = existing_by_hash[content_hash]
+            same_group = next((c for c in existing if c.group_id == group_obj.id), None)
+            if same_group:
+                duplicates.append((filename, same_group))
+                spool.close()
+                continue
+
+            unique_filename = f"{generate_unique_id()}_{secure_filename(filename)}"
+            filepath = os.path.join(UPLOAD_FOLDER, unique_filename)
+            await asyncio.to_thread(save_upload, spool, filepath, existing[0].filepath if existing else None)
+
+            uploaded = UploadedCV(
+                original_filename=filename,
+                stored_filename=unique_filename,
+                filepath=filepath,
+                group_id=group_obj.id,
+                group_rel=group_obj,
+                comment=None,
+                commented_at=None,
+                content_hash=content_hash
+            )
+            saved.append(uploaded)
+            if existing:
+                duplicate_of[unique_filename] = existing[0].stored_filename
+            existing.append(uploaded)
+
+        # All rows of the upload in one transaction; flushed first so ids are known before the commit
+        try:
+            session.add_all(saved)
+            await session.flush()
+            duplicates = [{"filename": filename, "duplicate_of": c.as_dict()} for filename, c in duplicates]
+            for uploaded in saved:
+                uploaded_file = uploaded.as_dict()
+                if uploaded.stored_filename in duplicate_of:
+                    uploaded_file["duplicate_of"] = duplicate_of[uploaded.stored_filename]
+                uploaded_files.append(uploaded_file)
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            for uploaded in saved:
+                if os.path.exists(uploaded.filepath):
+                    os.remove(uploaded.filepath)
+            raise
+
+        if not saved:
+            return {"uploaded": [], "duplicates": duplicates, "errors": errors}
+
+        # Extraction + embedding run in the background ingestion workers
+        job_id = await asyncio.to_thread(enqueue_job, group, [
+            {
+                "original_filename": uploaded.original_filename,
+                "stored_filename": uploaded.stored_filename,
+                "filepath": uploaded.filepath,
+                "content_hash": uploaded.content_hash
+            } for uploaded in saved
+        ])
+
+        return JSONResponse({
+            "job_id": job_id,
+            "status_url": f"/api/jobs/{job_id}",
+            "uploaded": uploaded_files,
+            "duplicates": duplicates,
+            "errors": errors
+        }, status_code=202)
+
+    except Exception as e:
+        logger.error("Error in /upload_cv: %s", traceback.format_exc())
+        return error(str(e), 500, trace=traceback.format_exc())
+
+@api.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    job = await asyncio.to_thread(get_job, job_id)
+    if job is None:
+        return error(f"Job '{job_id}' not found", 404)
+    return job
+
+
+# ───── Search APIs ─────
+async def load_cv_info(file_names):
+    """
+    Return {stored_filename: info} for the given CV files, with one query that selects only
+    the columns candidates are enriched with.
+    """
+    file_names = {name for name in file_names if name}
+    if not file_names:
+        return {}
+    async with Session() as session:
+        rows = (await session.execute(
+            select(
+                UploadedCV.id, UploadedCV.stored_filename, UploadedCV.original_filename,
+                UploadedCV.comment, UploadedCV.commented_at
+            ).where(UploadedCV.stored_filename.in_(file_names))
+        )).all()
+    return {
+        row.stored_filename: {
+            "cv_id": row.id,
+            "original_filename": row.original_filename,
+            "download_url": str(app.url_path_for("download", cv_id=row.id)),
+            "comment": row.comment,
+            "commented_at": row.commented_at.isoformat() if row.commented_at else None
+        } for row in rows
+    }
+
+def apply_cv_info(candidate, cv_info):
+    info = cv_info.get(candidate.get("file_name")) or {}
+    for field in ("cv_id", "original_filename", "download_url", "comment", "commented_at"):
+        candidate[field] = info.get(field)
+    return candidate
+
+async def enrich_candidates(*candidate_lists):
+    """
+    Attach CV id, original filename, download URL and comment to the LLM's candidates
+    (dicts with a "file_name"), for any number of candidate lists, with a single query.
+    """
+    cv_info = await load_cv_info(c.get("file_name") for candidates in candidate_lists for c in candidates)
+    for candidates in candidate_lists:
+        for candidate in candidates:
+            apply_cv_info(candidate, cv_info)
+
+def versioned_retrieve(query, scope, **search_options):
+    """
+    Blocking part of a search: the index version, then the retrieval. `scope` holds the
+    k, group and groups arguments of retrieve_for_prompt.
+    """
+    index_version = get_index_version(scope.get("groups") or scope.get("group"))
+    return retrieve_for_prompt(query, **scope, **search_options), index_version
+
+async def retrieve_for_query(query, group_name, **search_options):
+    """
+    Retrieve chunks for a search query, optionally scoped to a group.
+    `search_options` (ef_search, nprobe) are passed on to retrieve_for_prompt.
+    Returns ((results, index_version), None) or (None, error response).
+    """
+    if is_unset(group_name):
+        results, index_version = await asyncio.to_thread(
+            versioned_retrieve, query, {"k": 5, "group": None}, **search_options
+        )
+        if not results:
+            return None, error("No indexes or metadata found for any group.", 404)
+    else:
+        if await get_group_id(group_name) is None:
+            return None, error(f"Group '{group_name}' not found", 404)
+        results, index_version = await asyncio.to_thread(
+            versioned_retrieve, query, {"k": 5, "group": group_name}, **search_options
+        )
 
-    return JSONResponse(content={"uploaded": uploaded_files, "errors": errors})
+    return (results, index_version), None
 
+async def get_answer(prompt, index_version):
+    return await async_get_llm_answer(prompt, index_version, lambda: async_query_with_openai_sdk(prompt))
 
-@app.post("/search_api")
+@api.post("/search_api")
 async def search_api(data: dict):
     query = data.get("query")
-    group = data.get("group", "general")
+    group_name = data.get("group")  # Optional
 
     if not query:
-        raise HTTPException(status_code=400, detail="Query is required")
+        return error("No query provided", 400)
+    try:
+        search_options = parse_search_options(data)
+    except ValueError as e:
+        return error(str(e), 400)
 
     try:
-        # Run both steps concurrently
-        retrieved_chunks_task = asyncio.to_thread(retrieve_similar_chunks, query, 5, group)
-        prompt_task = asyncio.create_task(build_prompt_concurrently(query, retrieved_chunks_task))
+        retrieved, err = await retrieve_for_query(query, group_name, **search_options)
+        if err:
+            return err
+        results, index_version = retrieved
 
-        # Wait for prompt and LLM call
-        prompt, retrieved_chunks = await prompt_task
-        answer = await async_query_with_together_sdk(prompt)
+        prompt, prompt_stats = await asyncio.to_thread(build_prompt_with_stats, query, results)
+        answer = await get_answer(prompt, index_version)
 
-        return {
-            "results": retrieved_chunks,
-            "answer": answer
+        raw_response = {
+            "answer": answer,
+            "results": results,  # optional for UI/debugging
+            "usage": prompt_stats
+        }
+
+        summary = answer.get("summary")
+        candidate_details = answer.get("candidate_details")
+        if summary and summary not in ["1", "2"] and candidate_details:
+            await enrich_candidates(candidate_details)
+
+        return raw_response
+
+    except FileNotFoundError as e:
+        return error(str(e), 404)
+    except Exception as e:
+        logging.error("Unexpected error during search", exc_info=True)
+        return error("Internal server error", 500, details=str(e))
+
+async def retrieve_for_jd(file, group_name):
+    """
+    Extract a JD file and retrieve matching chunks, optionally scoped to a group.
+    Returns ((query, results, index_version), None) or (None, error response).
+    """
+    if not file or not file.filename:
+        return None, error("No file provided", 400)
+
+    filename = secure_filename(file.filename)
+    file_ext = os.path.splitext(filename)[1].lower()
+
+    if file_ext not in (".pdf", ".docx"):
+        return None, error("Only PDF and DOCX files are supported", 400)
+
+    # Extract from the in-memory bytes in the extraction process pool
+    try:
+        raw_text = await asyncio.to_thread(extract_text, await file.read(), file_ext)
+    except TimeoutError as e:
+        return None, error(str(e), 422)
+
+    if not raw_text.strip():
+        return None, error("Could not extract any text from file", 400)
+
+    # Keyword expansion of the query happens inside retrieval
+    query = raw_text.strip()
+
+    if is_unset(group_name):
+        groups = await asyncio.to_thread(group_map.names)
+        if not groups:
+            return None, error("No groups found", 404)
+        # One merged search over all groups (a single query when the global index is enabled)
+        results, index_version = await asyncio.to_thread(versioned_retrieve, query, {"k": 10, "groups": groups})
+    else:
+        if await get_group_id(group_name) is None:
+            return None, error(f"Group '{group_name}' not found", 404)
+        results, index_version = await asyncio.to_thread(versioned_retrieve, query, {"k": 5, "group": group_name})
+
+    return (query, results, index_version), None
+
+@api.post("/upload_jd")
+async def upload_jd(file: UploadFile = File(None), group: Optional[str] = Form(None)):
+    retrieved, err = await retrieve_for_jd(file, group)
+    if err:
+        return err
+    query, results, index_version = retrieved
+    prompt, prompt_stats = await asyncio.to_thread(build_prompt_with_stats, query, results)
+
+    try:
+        answer = await get_answer(prompt, index_version)
+    except Exception as e:
+        logging.error(f"LLM error: {e}")
+        return error("LLM failed", 500)
+
+    raw_response = {
+        "answer": answer,
+        "results": results,
+        "usage": prompt_stats
+    }
+
+    try:
+        normalized_response = normalize_llm_response(raw_response)
+        normalized_response["usage"] = prompt_stats
+
+        # The summary and candidates are inside the normalized "answer"
+        normalized_answer = normalized_response.get("answer") or {}
+        summary = normalized_answer.get("summary")
+        candidate_details = normalized_answer.get("candidate_details")
+
+        if summary not in ["1", "2"] and candidate_details:
+            await enrich_candidates(candidate_details)
+
+        return normalized_response
+
+    except Exception as inject_error:
+        logging.error(f"Post-processing error: {inject_error}", exc_info=True)
+        # Fallback to raw if LLM JSON structure was unexpected
+        return raw_response
+
+def read_jd_batch(files):
+    """
+    Expand uploaded JD files ((filename, bytes) pairs, zip archives included) into a list of
+    (filename, ext, bytes). Files that cannot be used are reported in the returned error list.
+    """
+    jds, errors = [], []
+
+    def add(name, read):
+        # `read()` returns the file's bytes; it is only called for a file that is kept
+        filename = secure_filename(os.path.basename(name))
+        ext = os.path.splitext(filename)[1].lower()
+        if ext not in (".pdf", ".docx"):
+            errors.append({"filename": name, "error": "Only PDF and DOCX files are supported"})
+        elif len(jds) >= JD_BATCH_MAX_FILES:
+            errors.append({"filename": name, "error": f"More than {JD_BATCH_MAX_FILES} JDs in one batch"})
+        else:
+            jds.append((filename, ext, read()))
+
+    for name, data in files:
+        if name.lower().endswith(".zip"):
+            try:
+                with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                    for member in archive.infolist():
+                        # Only the headers are looked at before a member is kept: nothing is
+                        # decompressed for skipped, oversized or surplus members
+                        if member.is_dir() or os.path.basename(member.filename).startswith("."):
+                            continue
+                        if len(jds) >= JD_BATCH_MAX_FILES:
+                            errors.append({
+                                "filename": name,
+                                "error": f"More than {JD_BATCH_MAX_FILES} JDs in one batch, the rest of the archive was skipped"
+                            })
+                            break
+                        if member.file_size > JD_BATCH_MAX_FILE_BYTES:
+                            errors.append({"filename": member.filename, "error": "File too large"})
+                            continue
+                        add(member.filename, lambda: archive.read(member))
+            except zipfile.BadZipFile:
+                errors.append({"filename": name, "error": "Invalid zip file"})
+        else:
+            add(name, lambda: data)
+
+    return jds, errors
+
+@api.post("/upload_jd/batch")
+async def upload_jd_batch(
+    files: List[UploadFile] = File(None),
+    file: List[UploadFile] = File(None),
+    group: Optional[str] = Form(None)
+):
+    """
+    Screen several JDs in one request: N PDF/DOCX files and/or zip archives of them.
+    All JDs are extracted concurrently, embedded in one batch and searched with one
+    multi-vector query per index; the LLM calls then run concurrently. Returns one
+    result per JD, in upload order.
+    """
+    files = files or file
+    if not files:
+        return error("No files provided", 400)
+
+    if is_unset(group):
+        groups = await asyncio.to_thread(group_map.names)
+        if not groups:
+            return error("No groups found", 404)
+        search_scope = {"k": 10, "groups": groups}
+    else:
+        if await get_group_id(group) is None:
+            return error(f"Group '{group}' not found", 404)
+        search_scope = {"k": 5, "group": group}
+    index_version = await asyncio.to_thread(get_index_version, search_scope.get("groups") or search_scope.get("group"))
+
+    uploads = [(f.filename or "", await f.read()) for f in files]
+    jds, errors = await asyncio.to_thread(read_jd_batch, uploads)
+    if not jds:
+        return JSONResponse({"results": [], "errors": errors}, status_code=400)
+
+    # 1. Extract every JD concurrently in the extraction process pool
+    texts = await asyncio.to_thread(extract_texts, [(data, ext) for _, ext, data in jds])
+    queries = []
+    for (filename, _, _), text in zip(jds, texts):
+        if isinstance(text, Exception):
+            errors.append({"filename": filename, "error": str(text)})
+            continue
+        query = text.strip()
+        if not query:
+            errors.append({"filename": filename, "error": "Could not extract any text from file"})
+            continue
+        queries.append((filename, query))
+
+    # 2. One batched embed and multi-vector search for all JDs
+    results_per_jd = await asyncio.to_thread(
+        retrieve_for_prompt_batch, [query for _, query in queries], **search_scope
+    )
+
+    # 3. Concurrent LLM calls, bounded by LLM_MAX_CONCURRENCY
+    prompts = await asyncio.to_thread(lambda: [
+        build_prompt_with_stats(query, results) for (_, query), results in zip(queries, results_per_jd)
+    ])
+    answers = await asyncio.gather(*(get_answer(prompt, index_version) for prompt, _ in prompts))
+
+    # One CV lookup for the candidates of every JD
+    await enrich_candidates(*[answer.get("candidate_details") or [] for answer in answers if isinstance(answer, dict)])
+
+    results = [
+        {
+            "filename": filename,
+            "answer": answer,
+            "results": results,
+            "usage": prompt_stats
         }
+        for (filename, _), results, (_, prompt_stats), answer in zip(queries, results_per_jd, prompts, answers)
+    ]
+    return {"results": results, "errors": errors}
+
+# ───── Streaming Search APIs ─────
+def ndjson(event):
+    return json.dumps(event) + "\n"
+
+async def stream_answer(prompt, results, index_version):
+    """
+    NDJSON event stream: the retrieved chunks right away, then the summary and each
+    candidate (with its CV comment) as soon as it is parsed out of the LLM stream,
+    then the complete answer.
+    """
+    yield ndjson({"type": "results", "results": results})
+
+    # Candidates are CVs of the retrieved chunks, so one lookup up front covers nearly all of them
+    cv_info = await load_cv_info(r["source_file"] for r in results)
+
+    async def enrich(candidate):
+        file_name = candidate.get("file_name")
+        if file_name and file_name not in cv_info:
+            cv_info.update(await load_cv_info([file_name]))
+        return apply_cv_info(candidate, cv_info)
+
+    answer = peek_llm_answer(prompt, index_version)
+    if answer is not None:
+        yield ndjson({"type": "summary", "summary": answer.get("summary")})
+        for candidate in answer.get("candidate_details") or []:
+            yield ndjson({"type": "candidate", "candidate": await enrich(candidate)})
+        yield ndjson({"type": "done", "answer": answer})
+        return
+
+    parser = CandidateStreamParser()
+    summary_sent = False
+    try:
+        async for delta in async_stream_query_with_openai_sdk(prompt):
+            candidates = parser.feed(delta)
+            if parser.summary is not None and not summary_sent:
+                summary_sent = True
+                yield ndjson({"type": "summary", "summary": parser.summary})
+            for candidate in candidates:
+                yield ndjson({"type": "candidate", "candidate": await enrich(candidate)})
+        answer = parser.result()
+    except Exception as e:
+        logging.error("Error streaming LLM answer", exc_info=True)
+        yield ndjson({"type": "error", "error": str(e)})
+        return
+
+    store_llm_answer(prompt, index_version, answer)
+
+    for candidate in answer.get("candidate_details") or []:
+        await enrich(candidate)
+    yield ndjson({"type": "done", "answer": answer})
+
+def ndjson_response(events):
+    return StreamingResponse(
+        events,
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api.post("/search_api/stream")
+async def search_api_stream(data: dict):
+    query = data.get("query")
+    group_name = data.get("group")  # Optional
+
+    if not query:
+        return error("No query provided", 400)
+    try:
+        search_options = parse_search_options(data)
+    except ValueError as e:
+        return error(str(e), 400)
+
+    try:
+        retrieved, err = await retrieve_for_query(query, group_name, **search_options)
+        if err:
+            return err
+        results, index_version = retrieved
+    except FileNotFoundError as e:
+        return error(str(e), 404)
+
+    prompt = await asyncio.to_thread(build_prompt, query, results)
+    return ndjson_response(stream_answer(prompt, results, index_version))
+
+@api.post("/upload_jd/stream")
+async def upload_jd_stream(file: UploadFile = File(None), group: Optional[str] = Form(None)):
+    retrieved, err = await retrieve_for_jd(file, group)
+    if err:
+        return err
+    query, results, index_version = retrieved
+
+    prompt = await asyncio.to_thread(build_prompt, query, results)
+    return ndjson_response(stream_answer(prompt, results, index_version))
+
+# ───── CV Listing API ─────
+@api.post("/cvs")
+async def get_cvs(data: Optional[dict] = None, session: AsyncSession = Depends(get_session)):
+    data = data or {}
+    group_name = data.get("group")
+    if is_unset(group_name):
+        group_name = None
+
+    try:
+        options, paginated = parse_list_options(data)
+    except ValueError as e:
+        return error(str(e), 400)
+
+    items, next_cursor = await session.run_sync(
+        lambda sync_session: list_cvs(sync_session, UploadedCV.__table__, Group.__table__, group_name, **options)
+    )
+    if paginated:
+        return {"items": items, "next_cursor": next_cursor}
+    return items
+
+# ───── Other Utility APIs ─────
+@api.get("/uploads/{filename}")
+async def uploaded_file(filename: str):
+    path = safe_join(UPLOAD_FOLDER, filename)
+    if path is None or not os.path.isfile(path):
+        return error("File not found", 404)
+    return FileResponse(path)
+
+@api.get("/download/{cv_id}")
+async def download(cv_id: int, session: AsyncSession = Depends(get_session)):
+    cv = await session.get(UploadedCV, cv_id)
+    path = safe_join(UPLOAD_FOLDER, cv.stored_filename) if cv else None
+    if path is None or not os.path.isfile(path):
+        return error(f"CV {cv_id} not found", 404)
+    return FileResponse(path, filename=cv.original_filename)
+
+def clear_files():
+    delete_all_chunks()
+
+    vector_dir = os.path.join(basedir, 'vector_store')
+    if os.path.exists(vector_dir):
+        for f in os.listdir(vector_dir):
+            path = os.path.join(vector_dir, f)
+            # Keep the lock files and the embedding store (a cache keyed by chunk text)
+            if os.path.isfile(path):
+                os.remove(path)
+    clear_index_cache()
+    clear_query_caches()
+
+    if os.path.exists(UPLOAD_FOLDER):
+        shutil.rmtree(UPLOAD_FOLDER)
+        os.makedirs(UPLOAD_FOLDER)
+
+@api.delete("/clear_all")
+async def clear_all(session: AsyncSession = Depends(get_session)):
+    try:
+        await session.execute(sql_delete(UploadedCV))
+        await session.execute(sql_delete(Group))
+        await session.commit()
+        group_map.invalidate()
+        await asyncio.to_thread(clear_files)
+        return {"message": "✅ Cleared all database entries, FAISS indexes, and uploaded files."}
+    except Exception as e:
+        logger.error("Error in /clear_all: %s", traceback.format_exc())
+        return error(str(e), 500)
+
+@api.delete("/delete/{cv_id}")
+async def delete(cv_id: int, session: AsyncSession = Depends(get_session)):
+    cv = await session.get(UploadedCV, cv_id)
+    if cv is None:
+        return error(f"CV {cv_id} not found", 404)
+    try:
+        await asyncio.to_thread(os.remove, cv.filepath)
+    except Exception as e:
+        return error(f"File deletion error: {str(e)}", 500)
+
+    # The row goes first: an ingestion job still running for this CV then skips it
+    await session.delete(cv)
+    await session.commit()
+    await asyncio.to_thread(delete_cv_data, cv.stored_filename, cv.group_rel.name)
+
+    return {"message": f"Deleted '{cv.original_filename}'"}
+
+@api.post("/cv/{cv_id}/comment")
+async def add_or_update_comment(cv_id: int, data: dict, session: AsyncSession = Depends(get_session)):
+    try:
+        comment = data.get("comment")
+        if not comment:
+            return error("Comment is required", 400)
+
+        cv = await session.get(UploadedCV, cv_id)
+        if cv is None:
+            return error(f"CV {cv_id} not found", 404)
+        cv.comment = comment
+        cv.commented_at = datetime.now(ZoneInfo("Asia/Kolkata"))  # IST
+        await session.commit()
+
+        logger.info(f"Comment added/updated for CV ID {cv_id}")
+        return {"message": "Comment added/updated", "cv": cv.as_dict()}
+
     except Exception as e:
-        return JSONResponse(status_code=500, content={"error": str(e), "trace": traceback.format_exc()})
+        logger.error("Error in POST /cv/%s/comment: %s", cv_id, traceback.format_exc())
+        return error(str(e), 500, trace=traceback.format_exc())
+
+@api.delete("/cv/{cv_id}/comment")
+async def delete_comment(cv_id: int, session: AsyncSession = Depends(get_session)):
+    try:
+        cv = await session.get(UploadedCV, cv_id)
+        if cv is None:
+            return error(f"CV {cv_id} not found", 404)
 
+        if not cv.comment:
+            return {"message": "No comment to delete"}
+
+        cv.comment = None
+        cv.commented_at = None
+        await session.commit()
+
+        logger.info(f"Comment deleted for CV ID {cv_id}")
+        return {"message": "Comment deleted", "cv": cv.as_dict()}
+
+    except Exception as e:
+        logger.error("Error in DELETE /cv/%s/comment: %s", cv_id, traceback.format_exc())
+        return error(str(e), 500, trace=traceback.format_exc())
 
-# helper: build prompt with awaited retrieval
-async def build_prompt_concurrently(query, retrieval_task):
-    retrieved_chunks = await retrieval_task
-    prompt = build_prompt(query, retrieved_chunks)
-    return prompt, retrieved_chunks
+app.include_router(api)
@@ -0,0 +1,25 @@
+# gunicorn -c gunicorn.conf.py main:app
+import os
+import importlib
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5001")
+workers = int(os.getenv("GUNICORN_WORKERS", 2))
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+
+
+def on_starting(server):
+    # Load the embedding model once in the master. Workers are forked after this and share
+    # the model's pages copy-on-write. The app itself is still imported per worker, so its
+    # background threads and extraction processes are started after the fork.
+    from utils.embeddings import preload_model
+    preload_model()
+
+
+def post_worker_init(worker):
+    # The app is imported by now; start its extraction processes and ingestion workers in
+    # this worker (the apps do not start them on import)
+    module = importlib.import_module(worker.app.app_uri.split(":")[0])
+    start = getattr(module, "start_background_workers", None)
+    if start is not None:
+        start()
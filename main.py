@@ -1,11 +1,27 @@
-from flask import Flask, request, send_from_directory, jsonify, Blueprint
+from flask import Flask, request, send_from_directory, jsonify, Blueprint, Response, stream_with_context, url_for
 import os
+import threading
+import json
+import zipfile
+from collections import defaultdict
 from werkzeug.utils import secure_filename
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
-from utils.cv_processing import process_and_store_embeddings, delete_cv_data, extract_text_from_pdf, extract_text_from_docx
-from utils.retriever import retrieve_similar_chunks, expand_query_with_keywords
-from utils.llm import build_prompt, query_with_openai_sdk, normalize_llm_response
+from utils.cv_processing import delete_cv_data
+from utils.extraction import extract_text, extract_texts, warm_up_extraction_pool
+from utils.retriever import retrieve_for_prompt, retrieve_for_prompt_batch, get_index_version
+from utils.llm import build_prompt, build_prompt_with_stats, query_with_openai_sdk, query_many_with_openai_sdk, normalize_llm_response, stream_query_with_openai_sdk, CandidateStreamParser
+from utils.index_cache import clear_index_cache
+from utils.index_factory import parse_search_options
+from utils.query_cache import get_llm_answer, peek_llm_answer, store_llm_answer, clear_query_caches
+from utils.chunk_store import delete_all_chunks
+from utils.ingest_queue import start_ingest_workers, enqueue_job, get_job
+from utils.content_cache import save_upload
+from utils.upload_stream import StreamingUploadRequest, spool_upload, remove_partial_uploads
+from utils.db import DATABASE_URI, add_missing_columns, engine_options
+from utils.cv_listing import list_cvs, parse_list_options
+from utils.group_cache import GroupMap
 import random
 import string
 from flask_cors import CORS
@@ -19,6 +35,8 @@ from zoneinfo import ZoneInfo  # native in Python 3.9+
 
 # Flask setup
 app = Flask(__name__)
+# Uploads are streamed by the multipart parser into the upload folder (CVs) or memory (JDs)
+app.request_class = StreamingUploadRequest
 CORS(app)
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -29,11 +47,17 @@ UPLOAD_FOLDER = os.path.join(basedir, 'uploaded_cvs')
 ALLOWED_EXTENSIONS = {'pdf', 'docx'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 70 * 1024 * 1024  # 70 MB limit
+app.config['DISK_UPLOAD_ENDPOINTS'] = {'api.upload_cv'}
+# Max JDs per /upload_jd/batch request (files plus zip members), and max size of one zip member
+JD_BATCH_MAX_FILES = int(os.getenv("JD_BATCH_MAX_FILES", 100))
+JD_BATCH_MAX_FILE_BYTES = 20 * 1024 * 1024
 
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
+remove_partial_uploads(UPLOAD_FOLDER)
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'cv_uploads.db')
+app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI  # cv_uploads.db unless DATABASE_URI is set
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(DATABASE_URI)
 db = SQLAlchemy(app)
 
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'fallback-insecure-key')
@@ -59,10 +83,17 @@ class UploadedCV(db.Model):
     original_filename = db.Column(db.String(255))
     stored_filename = db.Column(db.String(255), unique=True)
     filepath = db.Column(db.String(255))
-    upload_time = db.Column(db.DateTime, default=datetime.utcnow)
-    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
+    upload_time = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False, index=True)
     comment = db.Column(db.Text, nullable=True)
     commented_at = db.Column(db.DateTime, nullable=True)
+    content_hash = db.Column(db.String(64), nullable=True, index=True)  # sha256 of the file bytes
+
+    # Keyset pagination of /api/cvs, newest first, optionally within a group
+    __table_args__ = (
+        db.Index("ix_uploaded_cv_upload_time_id", "upload_time", "id"),
+        db.Index("ix_uploaded_cv_group_upload_time_id", "group_id", "upload_time", "id"),
+    )
 
     def as_dict(self):
         return {
@@ -73,10 +104,34 @@ class UploadedCV(db.Model):
             "upload_time": self.upload_time.isoformat(),
             "group": self.group_rel.name if self.group_rel else None,
             "comment": self.comment,
-            "commented_at": self.commented_at.isoformat() if self.commented_at else None
+            "commented_at": self.commented_at.isoformat() if self.commented_at else None,
+            "content_hash": self.content_hash
         }
 
 
+# Group name -> id, shared by the request threads of this worker. May be up to GROUP_CACHE_TTL
+# stale, so only used for lookups; writes resolve the group with get_or_create_group.
+group_map = GroupMap(lambda: db.session.query(Group.name, Group.id).all())
+
+def get_or_create_group(name):
+    """
+    Return the group called `name`, creating it if needed, in the current transaction, so that
+    rows written with its id in that transaction never point to a group deleted meanwhile.
+    """
+    group = Group.query.filter_by(name=name).first()
+    if group is None:
+        group = Group(name=name)
+        db.session.add(group)
+        try:
+            db.session.flush()
+        except IntegrityError:
+            # Created by another worker in the meantime
+            db.session.rollback()
+            group = Group.query.filter_by(name=name).one()
+        group_map.invalidate()
+    return group
+
+
 # ───── Utils ─────
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -84,6 +139,29 @@ def allowed_file(filename):
 def generate_unique_id(length=5):
     return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
 
+def remove_failed_upload(stored_filename):
+    """
+    Called by the ingestion workers when a CV could not be processed.
+    """
+    with app.app_context():
+        cv = UploadedCV.query.filter_by(stored_filename=stored_filename).first()
+        if not cv:
+            return
+        if os.path.exists(cv.filepath):
+            os.remove(cv.filepath)
+        db.session.delete(cv)
+        db.session.commit()
+
+def existing_uploads(stored_filenames):
+    """
+    Called by the ingestion workers before indexing: the CVs of a job that were not deleted meanwhile.
+    """
+    with app.app_context():
+        return {
+            name for (name,) in db.session.query(UploadedCV.stored_filename)
+            .filter(UploadedCV.stored_filename.in_(stored_filenames))
+        }
+
 # ───── Blueprint ─────
 api = Blueprint('api', __name__)
 
@@ -103,11 +181,12 @@ def create_group():
     name = data.get("name")
     if not name:
         return jsonify({"error": "Group name required"}), 400
-    if Group.query.filter_by(name=name).first():
+    if group_map.get_id(name) is not None:
         return jsonify({"error": "Group already exists"}), 400
     new_group = Group(name=name)
     db.session.add(new_group)
     db.session.commit()
+    group_map.invalidate()
     return jsonify(new_group.as_dict()), 201
 
 @api.route("/groups/<int:group_id>", methods=["DELETE"])
@@ -117,6 +196,7 @@ def delete_group(group_id):
         return jsonify({"error": "Cannot delete group with CVs linked to it."}), 400
     db.session.delete(group)
     db.session.commit()
+    group_map.invalidate()
     return jsonify({"message": f"Group '{group.name}' deleted."}), 200
 
 # ───── CV Upload API ─────
@@ -132,38 +212,96 @@ def upload_cv():
         if not group_name:
              return jsonify({"error": "No group selected."}), 400
 
-        group_obj = Group.query.filter_by(name=group_name).first()
-        if not group_obj:
-            group_obj = Group(name=group_name)
-            db.session.add(group_obj)
-            db.session.commit()
+        group_id = get_or_create_group(group_name).id
 
         uploaded_files = []
+        duplicates = []  # (filename, UploadedCV it duplicates)
         errors = []
+        saved = []
+        duplicate_of = {}  # stored_filename -> stored_filename of the existing copy in another group
 
+        # Each file is already on disk in the upload folder, hashed while the body was read
+        incoming = []
         for file in files:
             if file and allowed_file(file.filename):
-                unique_filename = f"{generate_unique_id()}_{secure_filename(file.filename)}"
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-                file.save(filepath)
-
-                uploaded = UploadedCV(
-                    original_filename=file.filename,
-                    stored_filename=unique_filename,
-                    filepath=filepath,
-                    group_id=group_obj.id,
-                    comment= None,
-                    commented_at = None
-                )
-                db.session.add(uploaded)
-                db.session.commit()
-
-                process_and_store_embeddings(filepath, file.filename, unique_filename, group_obj.name)
-                uploaded_files.append(uploaded.as_dict())
+                spool = spool_upload(file.stream, app.config['UPLOAD_FOLDER'])
+                incoming.append((file.filename, spool, spool.sha256))
             else:
                 errors.append({"filename": file.filename, "error": "Invalid file type"})
 
-        return jsonify({"uploaded": uploaded_files, "errors": errors}), 200
+        # Same bytes already uploaded: skip within the group, reuse file and vectors across groups.
+        # One lookup for all files; copies saved earlier in this request count as well.
+        existing_by_hash = defaultdict(list)
+        if incoming:
+            for cv in UploadedCV.query.filter(
+                UploadedCV.content_hash.in_({content_hash for _, _, content_hash in incoming})
+            ).order_by(UploadedCV.id):
+                existing_by_hash[cv.content_hash].append(cv)
+
+        for filename, spool, content_hash in incoming:
+            existing = existing_by_hash[content_hash]
+            same_group = next((cv for cv in existing if cv.group_id == group_id), None)
+            if same_group:
+                duplicates.append((filename, same_group))
+                spool.close()
+                continue
+
+            unique_filename = f"{generate_unique_id()}_{secure_filename(filename)}"
+            filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+            save_upload(spool, filepath, existing[0].filepath if existing else None)
+
+            uploaded = UploadedCV(
+                original_filename=filename,
+                stored_filename=unique_filename,
+                filepath=filepath,
+                group_id=group_id,
+                comment= None,
+                commented_at = None,
+                content_hash=content_hash
+            )
+            saved.append(uploaded)
+            if existing:
+                duplicate_of[unique_filename] = existing[0].stored_filename
+            existing.append(uploaded)
+
+        # All rows of the upload in one transaction; flushed first so ids are known before the commit
+        try:
+            db.session.add_all(saved)
+            db.session.flush()
+            duplicates = [{"filename": filename, "duplicate_of": cv.as_dict()} for filename, cv in duplicates]
+            for uploaded in saved:
+                uploaded_file = uploaded.as_dict()
+                if uploaded.stored_filename in duplicate_of:
+                    uploaded_file["duplicate_of"] = duplicate_of[uploaded.stored_filename]
+                uploaded_files.append(uploaded_file)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            for uploaded in saved:
+                if os.path.exists(uploaded.filepath):
+                    os.remove(uploaded.filepath)
+            raise
+
+        if not saved:
+            return jsonify({"uploaded": [], "duplicates": duplicates, "errors": errors}), 200
+
+        # Extraction + embedding run in the background ingestion workers
+        job_id = enqueue_job(group_name, [
+            {
+                "original_filename": uploaded.original_filename,
+                "stored_filename": uploaded.stored_filename,
+                "filepath": uploaded.filepath,
+                "content_hash": uploaded.content_hash
+            } for uploaded in saved
+        ])
+
+        return jsonify({
+            "job_id": job_id,
+            "status_url": f"/api/jobs/{job_id}",
+            "uploaded": uploaded_files,
+            "duplicates": duplicates,
+            "errors": errors
+        }), 202
 
     except Exception as e:
         logger.error("Error in /upload_cv: %s", traceback.format_exc())
@@ -171,35 +309,100 @@ def upload_cv():
 
 
 
+@api.route("/jobs/<job_id>", methods=["GET"])
+def get_job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": f"Job '{job_id}' not found"}), 404
+    return jsonify(job), 200
+
+
+def load_cv_info(file_names):
+    """
+    Return {stored_filename: info} for the given CV files, with one query that selects only
+    the columns candidates are enriched with.
+    """
+    file_names = {name for name in file_names if name}
+    if not file_names:
+        return {}
+    rows = db.session.query(
+        UploadedCV.id, UploadedCV.stored_filename, UploadedCV.original_filename,
+        UploadedCV.comment, UploadedCV.commented_at
+    ).filter(UploadedCV.stored_filename.in_(file_names)).all()
+    return {
+        row.stored_filename: {
+            "cv_id": row.id,
+            "original_filename": row.original_filename,
+            "download_url": url_for("api.download", cv_id=row.id),
+            "comment": row.comment,
+            "commented_at": row.commented_at.isoformat() if row.commented_at else None
+        } for row in rows
+    }
+
+def apply_cv_info(candidate, cv_info):
+    info = cv_info.get(candidate.get("file_name")) or {}
+    for field in ("cv_id", "original_filename", "download_url", "comment", "commented_at"):
+        candidate[field] = info.get(field)
+    return candidate
+
+def enrich_candidates(*candidate_lists):
+    """
+    Attach CV id, original filename, download URL and comment to the LLM's candidates
+    (dicts with a "file_name"), for any number of candidate lists, with a single query.
+    """
+    cv_info = load_cv_info(c.get("file_name") for candidates in candidate_lists for c in candidates)
+    for candidates in candidate_lists:
+        for candidate in candidates:
+            apply_cv_info(candidate, cv_info)
+
+
+def retrieve_for_query(query, group_name, **search_options):
+    """
+    Retrieve chunks for a search query, optionally scoped to a group.
+    `search_options` (ef_search, nprobe) are passed on to retrieve_for_prompt.
+    Returns ((results, index_version), None) or (None, error response).
+    """
+    if not group_name or str(group_name).lower() in ["null", "undefined", ""]:
+        index_version = get_index_version()
+        results = retrieve_for_prompt(query, k=5, group=None, **search_options)
+        if not results:
+            return None, (jsonify({"error": "No indexes or metadata found for any group."}), 404)
+    else:
+        if group_map.get_id(group_name) is None:
+            return None, (jsonify({"error": f"Group '{group_name}' not found"}), 404)
+
+        index_version = get_index_version(group_name)
+        results = retrieve_for_prompt(query, k=5, group=group_name, **search_options)
+
+    return (results, index_version), None
+
+
 @api.route("/search_api", methods=["POST"])
 def search_api():
     data = request.get_json()
     query = data.get("query")
     group_name = data.get("group")  # Optional
 
-    query = expand_query_with_keywords(query)
-
     if not query:
         return jsonify({"error": "No query provided"}), 400
-
     try:
-        if not group_name or str(group_name).lower() in ["null", "undefined", ""]:
-            results = retrieve_similar_chunks(query, k=5, group=None)
-            if not results:
-                return jsonify({"error": "No indexes or metadata found for any group."}), 404
-        else:
-            group_obj = Group.query.filter_by(name=group_name).first()
-            if not group_obj:
-                return jsonify({"error": f"Group '{group_name}' not found"}), 404
+        search_options = parse_search_options(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-            results = retrieve_similar_chunks(query, k=5, group=group_obj.name)
+    try:
+        retrieved, error = retrieve_for_query(query, group_name, **search_options)
+        if error:
+            return error
+        results, index_version = retrieved
 
-        prompt = build_prompt(query, results)
-        answer = query_with_openai_sdk(prompt)
+        prompt, prompt_stats = build_prompt_with_stats(query, results)
+        answer = get_llm_answer(prompt, index_version, lambda: query_with_openai_sdk(prompt))
 
         raw_response = {
             "answer": answer,
-            "results": results  # optional for UI/debugging
+            "results": results,  # optional for UI/debugging
+            "usage": prompt_stats
         }
 
         # ✅ If answer has candidate_details and a valid summary
@@ -207,21 +410,7 @@ def search_api():
         candidate_details = answer.get("candidate_details")
 
         if summary and summary not in ["1", "2"] and candidate_details:
-            file_names = [c["file_name"] for c in candidate_details]
-
-            cvs = UploadedCV.query.filter(UploadedCV.stored_filename.in_(file_names)).all()
-            cv_map = {
-                cv.stored_filename: {
-                    "comment": cv.comment,
-                    "commented_at": cv.commented_at.isoformat() if cv.commented_at else None
-                } for cv in cvs
-            }
-
-            for candidate in candidate_details:
-                file_name = candidate["file_name"]
-                comment_data = cv_map.get(file_name, {})
-                candidate["comment"] = comment_data.get("comment")
-                candidate["commented_at"] = comment_data.get("commented_at")
+            enrich_candidates(candidate_details)
 
         return jsonify(raw_response), 200
 
@@ -232,88 +421,83 @@ def search_api():
         return jsonify({"error": "Internal server error", "details": str(e)}), 500
 
 
-@api.route("/upload_jd", methods=["POST"])
-def upload_jd():
-    file = request.files.get("file")
-    group_name = request.form.get("group")
-
+def retrieve_for_jd(file, group_name):
+    """
+    Extract a JD file and retrieve matching chunks, optionally scoped to a group.
+    Returns ((query, results, index_version), None) or (None, error response).
+    """
     if not file:
-        return jsonify({"error": "No file provided"}), 400
+        return None, (jsonify({"error": "No file provided"}), 400)
 
     filename = secure_filename(file.filename)
     file_ext = os.path.splitext(filename)[1].lower()
 
-    file_bytes = file
-    if file_ext == ".pdf":
-        raw_text = extract_text_from_pdf(file_bytes)
-    elif file_ext == ".docx":
-        raw_text = extract_text_from_docx(file_bytes)
-    else:
-        return jsonify({"error": "Only PDF and DOCX files are supported"}), 400
+    if file_ext not in (".pdf", ".docx"):
+        return None, (jsonify({"error": "Only PDF and DOCX files are supported"}), 400)
 
-    if not raw_text.strip():
-        return jsonify({"error": "Could not extract any text from file"}), 400
+    # The JD was parsed into memory (it never touches disk); read() returns that buffer without a
+    # copy, which is extracted in the extraction process pool
+    try:
+        raw_text = extract_text(file.read(), file_ext)
+    except TimeoutError as e:
+        return None, (jsonify({"error": str(e)}), 422)
 
-    query = expand_query_with_keywords(raw_text.strip())
+    if not raw_text.strip():
+        return None, (jsonify({"error": "Could not extract any text from file"}), 400)
 
-    if not query:
-        return jsonify({"error": "Could not derive search query from file"}), 400
+    # Keyword expansion of the query happens inside retrieval
+    query = raw_text.strip()
 
     if not group_name or group_name.lower() in ["null", "undefined", ""]:
-        groups = [g.name for g in Group.query.all()]
+        groups = group_map.names()
         if not groups:
-            return jsonify({"error": "No groups found"}), 404
-
-        all_results = []
-        for grp in groups:
-            results = retrieve_similar_chunks(query, k=5, group=grp)
-            all_results.extend(results)
+            return None, (jsonify({"error": "No groups found"}), 404)
 
-        all_results = sorted(all_results, key=lambda x: x.get("score", 0), reverse=True)[:10]
-        prompt = build_prompt(query, all_results)
-        results = all_results
+        index_version = get_index_version(groups)
+        # One merged search over all groups (a single query when the global index is enabled)
+        results = retrieve_for_prompt(query, k=10, groups=groups)
     else:
-        group_obj = Group.query.filter_by(name=group_name).first()
-        if not group_obj:
-            return jsonify({"error": f"Group '{group_name}' not found"}), 404
+        if group_map.get_id(group_name) is None:
+            return None, (jsonify({"error": f"Group '{group_name}' not found"}), 404)
+
+        index_version = get_index_version(group_name)
+        results = retrieve_for_prompt(query, k=5, group=group_name)
 
-        results = retrieve_similar_chunks(query, k=5, group=group_obj.name)
-        prompt = build_prompt(query, results)
+    return (query, results, index_version), None
+
+
+@api.route("/upload_jd", methods=["POST"])
+def upload_jd():
+    retrieved, error = retrieve_for_jd(request.files.get("file"), request.form.get("group"))
+    if error:
+        return error
+    query, results, index_version = retrieved
+    prompt, prompt_stats = build_prompt_with_stats(query, results)
 
     try:
-        answer = query_with_openai_sdk(prompt)
+        answer = get_llm_answer(prompt, index_version, lambda: query_with_openai_sdk(prompt))
     except Exception as e:
         logging.error(f"LLM error: {e}")
         return jsonify({"error": "LLM failed"}), 500
 
     raw_response = {
         "answer": answer,
-        "results": results
+        "results": results,
+        "usage": prompt_stats
     }
 
     # ✅ Try to inject comment/commented_at
     try:
         normalized_response = normalize_llm_response(raw_response)
+        normalized_response["usage"] = prompt_stats
 
-        summary = normalized_response.get("summary")
-        candidate_details = normalized_response.get("candidate_details")
+        # The summary and candidates are inside the normalized "answer"
+        normalized_answer = normalized_response.get("answer") or {}
+        summary = normalized_answer.get("summary")
+        candidate_details = normalized_answer.get("candidate_details")
 
         if summary not in ["1", "2"] and candidate_details:
-            file_names = [c["file_name"] for c in candidate_details]
-
-            cvs = UploadedCV.query.filter(UploadedCV.stored_filename.in_(file_names)).all()
-            cv_map = {
-                cv.stored_filename: {
-                    "comment": cv.comment,
-                    "commented_at": cv.commented_at.isoformat() if cv.commented_at else None
-                } for cv in cvs
-            }
-
-            for candidate in candidate_details:
-                file_name = candidate["file_name"]
-                comment_data = cv_map.get(file_name, {})
-                candidate["comment"] = comment_data.get("comment")
-                candidate["commented_at"] = comment_data.get("commented_at")
+            enrich_candidates(candidate_details)
 
         return jsonify(normalized_response), 200
 
@@ -322,21 +506,225 @@ def upload_jd():
         # Fallback to raw if LLM JSON structure was unexpected
         return jsonify(raw_response), 200
 
+def read_jd_batch(files):
+    """
+    Read uploaded JD files, expanding zip archives, into a list of (filename, ext, bytes).
+    Files that cannot be used are reported in the returned error list.
+    """
+    jds, errors = [], []
+
+    def add(name, read):
+        # `read()` returns the file's bytes; it is only called for a file that is kept
+        filename = secure_filename(os.path.basename(name))
+        ext = os.path.splitext(filename)[1].lower()
+        if ext not in (".pdf", ".docx"):
+            errors.append({"filename": name, "error": "Only PDF and DOCX files are supported"})
+        elif len(jds) >= JD_BATCH_MAX_FILES:
+            errors.append({"filename": name, "error": f"More than {JD_BATCH_MAX_FILES} JDs in one batch"})
+        else:
+            jds.append((filename, ext, read()))
+
+    for file in files:
+        if file.filename.lower().endswith(".zip"):
+            try:
+                with zipfile.ZipFile(file.stream) as archive:
+                    for member in archive.infolist():
+                        # Only the headers are looked at before a member is kept: nothing is
+                        # decompressed for skipped, oversized or surplus members
+                        if member.is_dir() or os.path.basename(member.filename).startswith("."):
+                            continue
+                        if len(jds) >= JD_BATCH_MAX_FILES:
+                            errors.append({
+                                "filename": file.filename,
+                                "error": f"More than {JD_BATCH_MAX_FILES} JDs in one batch, the rest of the archive was skipped"
+                            })
+                            break
+                        if member.file_size > JD_BATCH_MAX_FILE_BYTES:
+                            errors.append({"filename": member.filename, "error": "File too large"})
+                            continue
+                        add(member.filename, lambda: archive.read(member))
+            except zipfile.BadZipFile:
+                errors.append({"filename": file.filename, "error": "Invalid zip file"})
+        else:
+            add(file.filename, file.read)
+
+    return jds, errors
+
+
+@api.route("/upload_jd/batch", methods=["POST"])
+def upload_jd_batch():
+    """
+    Screen several JDs in one request: N PDF/DOCX files and/or zip archives of them.
+    All JDs are extracted concurrently, embedded in one batch and searched with one
+    multi-vector query per index; the LLM calls then run concurrently. Returns one
+    result per JD, in upload order.
+    """
+    files = request.files.getlist("files") or request.files.getlist("file")
+    if not files:
+        return jsonify({"error": "No files provided"}), 400
+    group_name = request.form.get("group")
+
+    if not group_name or group_name.lower() in ["null", "undefined", ""]:
+        groups = group_map.names()
+        if not groups:
+            return jsonify({"error": "No groups found"}), 404
+        search_scope = {"k": 10, "groups": groups}
+        index_version = get_index_version(groups)
+    else:
+        if group_map.get_id(group_name) is None:
+            return jsonify({"error": f"Group '{group_name}' not found"}), 404
+        search_scope = {"k": 5, "group": group_name}
+        index_version = get_index_version(group_name)
+
+    jds, errors = read_jd_batch(files)
+    if not jds:
+        return jsonify({"results": [], "errors": errors}), 400
+
+    # 1. Extract every JD concurrently in the extraction process pool
+    queries = []
+    for (filename, _, _), text in zip(jds, extract_texts([(data, ext) for _, ext, data in jds])):
+        if isinstance(text, Exception):
+            errors.append({"filename": filename, "error": str(text)})
+            continue
+        query = text.strip()
+        if not query:
+            errors.append({"filename": filename, "error": "Could not extract any text from file"})
+            continue
+        queries.append((filename, query))
+
+    # 2. One batched embed and multi-vector search for all JDs
+    results_per_jd = retrieve_for_prompt_batch([query for _, query in queries], **search_scope)
+
+    # 3. Concurrent LLM calls, bounded by LLM_MAX_CONCURRENCY
+    prompts = [build_prompt_with_stats(query, results) for (_, query), results in zip(queries, results_per_jd)]
+    answers = query_many_with_openai_sdk([
+        lambda prompt=prompt: get_llm_answer(prompt, index_version, lambda: query_with_openai_sdk(prompt))
+        for prompt, _ in prompts
+    ])
+
+    # One CV lookup for the candidates of every JD
+    enrich_candidates(*[answer.get("candidate_details") or [] for answer in answers if isinstance(answer, dict)])
+
+    results = [
+        {
+            "filename": filename,
+            "answer": answer,
+            "results": results,
+            "usage": prompt_stats
+        }
+        for (filename, _), results, (_, prompt_stats), answer in zip(queries, results_per_jd, prompts, answers)
+    ]
+    return jsonify({"results": results, "errors": errors}), 200
+
+# ───── Streaming Search APIs ─────
+def ndjson(event):
+    return json.dumps(event) + "\n"
+
+def stream_answer(prompt, results, index_version):
+    """
+    NDJSON event stream: the retrieved chunks right away, then the summary and each
+    candidate (with its CV comment) as soon as it is parsed out of the LLM stream,
+    then the complete answer.
+    """
+    yield ndjson({"type": "results", "results": results})
+
+    # Candidates are CVs of the retrieved chunks, so one lookup up front covers nearly all of them
+    cv_info = load_cv_info(r["source_file"] for r in results)
+
+    def enrich(candidate):
+        file_name = candidate.get("file_name")
+        if file_name and file_name not in cv_info:
+            cv_info.update(load_cv_info([file_name]))
+        return apply_cv_info(candidate, cv_info)
+
+    answer = peek_llm_answer(prompt, index_version)
+    if answer is not None:
+        yield ndjson({"type": "summary", "summary": answer.get("summary")})
+        for candidate in answer.get("candidate_details") or []:
+            yield ndjson({"type": "candidate", "candidate": enrich(candidate)})
+        yield ndjson({"type": "done", "answer": answer})
+        return
+
+    parser = CandidateStreamParser()
+    summary_sent = False
+    try:
+        for delta in stream_query_with_openai_sdk(prompt):
+            candidates = parser.feed(delta)
+            if parser.summary is not None and not summary_sent:
+                summary_sent = True
+                yield ndjson({"type": "summary", "summary": parser.summary})
+            for candidate in candidates:
+                yield ndjson({"type": "candidate", "candidate": enrich(candidate)})
+        answer = parser.result()
+    except Exception as e:
+        logging.error("Error streaming LLM answer", exc_info=True)
+        yield ndjson({"type": "error", "error": str(e)})
+        return
+
+    store_llm_answer(prompt, index_version, answer)
+
+    for candidate in answer.get("candidate_details") or []:
+        enrich(candidate)
+    yield ndjson({"type": "done", "answer": answer})
+
+def ndjson_response(events):
+    return Response(
+        stream_with_context(events),
+        mimetype="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api.route("/search_api/stream", methods=["POST"])
+def search_api_stream():
+    data = request.get_json()
+    query = data.get("query")
+    group_name = data.get("group")  # Optional
+
+    if not query:
+        return jsonify({"error": "No query provided"}), 400
+    try:
+        search_options = parse_search_options(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        retrieved, error = retrieve_for_query(query, group_name, **search_options)
+        if error:
+            return error
+        results, index_version = retrieved
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+
+    prompt = build_prompt(query, results)
+    return ndjson_response(stream_answer(prompt, results, index_version))
+
+@api.route("/upload_jd/stream", methods=["POST"])
+def upload_jd_stream():
+    retrieved, error = retrieve_for_jd(request.files.get("file"), request.form.get("group"))
+    if error:
+        return error
+    query, results, index_version = retrieved
+
+    prompt = build_prompt(query, results)
+    return ndjson_response(stream_answer(prompt, results, index_version))
+
 # ───── CV Listing API ─────
 @api.route("/cvs", methods=["POST"])
 def get_cvs():
     data = request.get_json() or {}
     group_name = data.get("group")
-
     if not group_name or str(group_name).lower() in ["null", "undefined", ""]:
-        uploads = UploadedCV.query.order_by(UploadedCV.upload_time.desc()).all()
-    else:
-        group_obj = Group.query.filter_by(name=group_name).first()
-        if not group_obj:
-            return jsonify([]), 200
-        uploads = UploadedCV.query.filter_by(group_id=group_obj.id).order_by(UploadedCV.upload_time.desc()).all()
+        group_name = None
+
+    try:
+        options, paginated = parse_list_options(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    return jsonify([upload.as_dict() for upload in uploads]), 200
+    items, next_cursor = list_cvs(db.session, UploadedCV.__table__, Group.__table__, group_name, **options)
+    if paginated:
+        return jsonify({"items": items, "next_cursor": next_cursor}), 200
+    return jsonify(items), 200
 
 # ───── Other Utility APIs ─────
 @api.route("/uploads/<filename>", methods=["GET"])
@@ -354,11 +742,18 @@ def clear_all():
         UploadedCV.query.delete()
         Group.query.delete()
         db.session.commit()
+        group_map.invalidate()
+        delete_all_chunks()
 
         vector_dir = os.path.join(basedir, 'vector_store')
         if os.path.exists(vector_dir):
             for f in os.listdir(vector_dir):
-                os.remove(os.path.join(vector_dir, f))
+                path = os.path.join(vector_dir, f)
+                # Keep the lock files and the embedding store (a cache keyed by chunk text)
+                if os.path.isfile(path):
+                    os.remove(path)
+        clear_index_cache()
+        clear_query_caches()
 
         if os.path.exists(app.config['UPLOAD_FOLDER']):
             shutil.rmtree(app.config['UPLOAD_FOLDER'])
@@ -377,9 +772,11 @@ def delete(cv_id):
     except Exception as e:
         return jsonify({"error": f"File deletion error: {str(e)}"}), 500
 
-    delete_cv_data(cv.stored_filename, group=cv.group_rel.name)
+    # The row goes first: an ingestion job still running for this CV then skips it
+    stored_filename, group_name = cv.stored_filename, cv.group_rel.name
     db.session.delete(cv)
     db.session.commit()
+    delete_cv_data(stored_filename, group=group_name)
 
     return jsonify({"message": f"Deleted '{cv.original_filename}'"}), 200
 
@@ -428,10 +825,39 @@ def delete_comment(cv_id):
 
 # ───── App Runner ─────
 app.register_blueprint(api, url_prefix='/api')
+with app.app_context():
+    # Columns added since the tables were first created
+    add_missing_columns(UploadedCV.__table__, db.engine)
+
+_workers_started = False
+_workers_lock = threading.Lock()
+
+def start_background_workers():
+    """
+    Start the text extraction processes and the ingestion workers of this process. Called by
+    the server once per worker process (gunicorn.conf.py, or the dev server below) rather than
+    on import, so tooling and the reloader's watcher process do not start them.
+    """
+    global _workers_started
+    with _workers_lock:
+        if _workers_started:
+            return
+        warm_up_extraction_pool()
+        start_ingest_workers(on_file_failed=remove_failed_upload, existing_files=existing_uploads)
+        _workers_started = True
+
+@app.before_request
+def ensure_background_workers():
+    # Servers without a startup hook (e.g. `flask run`) start them on the first request
+    if not _workers_started:
+        start_background_workers()
 
 if __name__ == '__main__':
     with app.app_context():
         print("Creating db ");
         db.create_all()
         print("Tables created")
+    # With the reloader, the app is served by a child process started with WERKZEUG_RUN_MAIN
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_workers()
     app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
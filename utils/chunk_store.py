@@ -0,0 +1,216 @@
+import threading
+from sqlalchemy import Table, Column, Integer, BigInteger, String, Text, Index, select, insert, delete, func
+from sqlalchemy.exc import IntegrityError
+from utils.db import engine, metadata, init_db
+from utils import lexical_index
+
+# One row per embedded chunk. `faiss_id` is the id of the chunk's vector in its group's
+# ID-mapped FAISS index; `group_name` is the normalized group key used for the index file.
+chunk_table = Table(
+    "chunk", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("group_name", String(255), nullable=False),
+    Column("faiss_id", BigInteger, nullable=False),
+    Column("chunk_index", Integer, nullable=False),
+    Column("text", Text, nullable=False),
+    Column("source_file", String(255), nullable=False),
+    Index("ix_chunk_group_faiss_id", "group_name", "faiss_id", unique=True),
+    Index("ix_chunk_source_file", "source_file"),
+)
+
+# Stable small integer per group, used to give each group its own id range in the global index
+index_group_table = Table(
+    "index_group", metadata,
+    Column("slot", Integer, primary_key=True),
+    Column("group_name", String(255), nullable=False, unique=True),
+)
+
+_slots = {}
+_groups_by_slot = {}
+_slots_lock = threading.Lock()
+
+
+def group_key(group):
+    return group.replace(" ", "_").lower()
+
+
+def init_chunk_store():
+    init_db()
+
+
+def _row_to_chunk(row):
+    return {
+        "id": row.faiss_id,
+        "chunk_index": row.chunk_index,
+        "text": row.text,
+        "source_file": row.source_file,
+        "group": row.group_name
+    }
+
+
+def next_faiss_id(group, conn=None):
+    init_chunk_store()
+    stmt = select(func.max(chunk_table.c.faiss_id)).where(chunk_table.c.group_name == group_key(group))
+    if conn is not None:
+        current = conn.execute(stmt).scalar()
+    else:
+        with engine.connect() as c:
+            current = c.execute(stmt).scalar()
+    return 0 if current is None else current + 1
+
+
+def add_chunks(group, chunks, conn=None):
+    """
+    Append chunk metadata dicts (as built by create_chunks_with_metadata) for a group,
+    and add them to the group's BM25 inverted index.
+    """
+    if not chunks:
+        return
+    init_chunk_store()
+    rows = [
+        {
+            "group_name": group_key(group),
+            "faiss_id": chunk["id"],
+            "chunk_index": chunk["chunk_index"],
+            "text": chunk["text"],
+            "source_file": chunk["source_file"]
+        } for chunk in chunks
+    ]
+    if conn is not None:
+        conn.execute(insert(chunk_table), rows)
+        lexical_index.add_chunks(group, chunks, conn)
+    else:
+        with engine.begin() as c:
+            c.execute(insert(chunk_table), rows)
+            lexical_index.add_chunks(group, chunks, c)
+
+
+def get_chunks_by_faiss_ids(group, faiss_ids):
+    """
+    Keyed lookup of only the requested chunks. Returns {faiss_id: chunk}.
+    """
+    faiss_ids = [int(i) for i in faiss_ids if i >= 0]
+    if not faiss_ids:
+        return {}
+    init_chunk_store()
+    stmt = select(chunk_table).where(
+        chunk_table.c.group_name == group_key(group),
+        chunk_table.c.faiss_id.in_(faiss_ids)
+    )
+    with engine.connect() as c:
+        return {row.faiss_id: _row_to_chunk(row) for row in c.execute(stmt)}
+
+
+def get_group_chunks(group):
+    """
+    (faiss_id, text) of every chunk of a group, in id order.
+    """
+    init_chunk_store()
+    stmt = select(chunk_table.c.faiss_id, chunk_table.c.text).where(
+        chunk_table.c.group_name == group_key(group)
+    ).order_by(chunk_table.c.faiss_id)
+    with engine.connect() as c:
+        return [(row.faiss_id, row.text) for row in c.execute(stmt)]
+
+
+def get_faiss_ids_for_file(group, source_file):
+    init_chunk_store()
+    stmt = select(chunk_table.c.faiss_id).where(
+        chunk_table.c.group_name == group_key(group),
+        chunk_table.c.source_file == source_file
+    )
+    with engine.connect() as c:
+        return [row.faiss_id for row in c.execute(stmt)]
+
+
+def get_stored_files(group, source_files):
+    """
+    The files among `source_files` that already have chunks in the group.
+    """
+    init_chunk_store()
+    stmt = select(chunk_table.c.source_file).distinct().where(
+        chunk_table.c.group_name == group_key(group),
+        chunk_table.c.source_file.in_(source_files)
+    )
+    with engine.connect() as c:
+        return {row.source_file for row in c.execute(stmt)}
+
+
+def delete_chunks_for_file(group, source_file, conn=None):
+    init_chunk_store()
+    where = (chunk_table.c.group_name == group_key(group)) & (chunk_table.c.source_file == source_file)
+    file_ids = select(chunk_table.c.faiss_id).where(where)
+    if conn is not None:
+        lexical_index.delete_chunks(group, file_ids, conn)
+        conn.execute(delete(chunk_table).where(where))
+    else:
+        with engine.begin() as c:
+            lexical_index.delete_chunks(group, file_ids, c)
+            c.execute(delete(chunk_table).where(where))
+
+
+def delete_chunks_for_group(group, conn=None):
+    init_chunk_store()
+    stmt = delete(chunk_table).where(chunk_table.c.group_name == group_key(group))
+    if conn is not None:
+        conn.execute(stmt)
+        lexical_index.delete_group(group, conn)
+    else:
+        with engine.begin() as c:
+            c.execute(stmt)
+            lexical_index.delete_group(group, c)
+
+
+def count_chunks(group):
+    init_chunk_store()
+    stmt = select(func.count()).select_from(chunk_table).where(chunk_table.c.group_name == group_key(group))
+    with engine.connect() as c:
+        return c.execute(stmt).scalar()
+
+
+def delete_all_chunks():
+    init_chunk_store()
+    with engine.begin() as c:
+        c.execute(delete(chunk_table))
+        lexical_index.delete_all(c)
+
+
+def get_group_slot(group):
+    """
+    Return the group's slot number, assigning the next free one on first use.
+    """
+    key = group_key(group)
+    if key in _slots:
+        return _slots[key]
+
+    init_chunk_store()
+    with _slots_lock:
+        # Slots are never deleted, so after losing an insert race the select finds the row
+        for _ in range(3):
+            with engine.connect() as c:
+                slot = c.execute(
+                    select(index_group_table.c.slot).where(index_group_table.c.group_name == key)
+                ).scalar()
+            if slot is not None:
+                break
+            try:
+                with engine.begin() as c:
+                    slot = c.execute(insert(index_group_table).values(group_name=key)).inserted_primary_key[0]
+                break
+            except IntegrityError:
+                continue  # assigned concurrently by another process, read it back
+        else:
+            raise RuntimeError(f"Could not assign an index slot to group '{key}'")
+        _slots[key] = slot
+        _groups_by_slot[slot] = key
+    return slot
+
+
+def get_group_for_slot(slot):
+    if slot not in _groups_by_slot:
+        init_chunk_store()
+        with engine.connect() as c:
+            for row in c.execute(select(index_group_table)):
+                _slots[row.group_name] = row.slot
+                _groups_by_slot[row.slot] = row.group_name
+    return _groups_by_slot.get(slot)
@@ -0,0 +1,105 @@
+import os
+import json
+import hashlib
+from datetime import datetime
+from sqlalchemy import Table, Column, String, Text, DateTime, Index, select, text
+from sqlalchemy.exc import IntegrityError
+from utils.db import engine, metadata, init_db
+
+# Store a re-uploaded file as a hard link to the existing copy instead of writing it again
+DEDUP_UPLOAD_FILES = os.getenv("DEDUP_UPLOAD_FILES", "true").lower() in ("1", "true", "yes")
+
+# Content-addressed cache of what extracting a file produced: its chunks. `file_hash` is the
+# sha256 of the file bytes, `text_hash` the sha256 of its cleaned text, so a re-upload skips
+# extraction. The chunks' vectors are not kept here but in the embedding store, keyed by chunk
+# text, which serves them to a re-upload (or a different file with the same text) without the model.
+content_cache_table = Table(
+    "content_chunks", metadata,
+    Column("file_hash", String(64), primary_key=True),
+    Column("text_hash", String(64), nullable=False),
+    Column("chunks", Text, nullable=False),  # JSON list of chunk texts
+    Column("created_at", DateTime, default=datetime.utcnow),
+    Index("ix_content_chunks_text_hash", "text_hash"),
+)
+
+_legacy_dropped = False
+
+
+def _init():
+    global _legacy_dropped
+    init_db()
+    if not _legacy_dropped:
+        # The previous cache table also held every file's vectors, duplicating the embedding store
+        with engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS content_cache"))
+        _legacy_dropped = True
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_text(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def get_by_file_hash(file_hash):
+    """
+    Return the chunks cached for a file with these bytes, or None.
+    """
+    _init()
+    with engine.connect() as conn:
+        chunks = conn.execute(
+            select(content_cache_table.c.chunks).where(content_cache_table.c.file_hash == file_hash)
+        ).scalar()
+    return json.loads(chunks) if chunks is not None else None
+
+
+def get_by_text_hash(text_hash):
+    """
+    Return the chunks cached for any file with this cleaned text, or None.
+    """
+    _init()
+    with engine.connect() as conn:
+        chunks = conn.execute(
+            select(content_cache_table.c.chunks).where(content_cache_table.c.text_hash == text_hash).limit(1)
+        ).scalar()
+    return json.loads(chunks) if chunks is not None else None
+
+
+def store(file_hash, text_hash, chunks):
+    _init()
+    try:
+        with engine.begin() as conn:
+            conn.execute(content_cache_table.insert().values(
+                file_hash=file_hash,
+                text_hash=text_hash,
+                chunks=json.dumps(chunks)
+            ))
+    except IntegrityError:
+        pass  # cached concurrently by another worker
+
+
+def save_upload(spool, filepath, existing_path=None):
+    """
+    Store an upload spooled into the upload folder (a utils.upload_stream.HashingFile) under
+    `filepath`, a rename since its bytes are already on disk. If an identical file is already
+    stored at `existing_path`, hard-link to it instead and drop the spool, so the bytes are kept
+    on disk once; each name can still be deleted on its own.
+    """
+    if DEDUP_UPLOAD_FILES and existing_path and os.path.exists(existing_path):
+        try:
+            os.link(existing_path, filepath)
+            spool.close()
+            return
+        except OSError:
+            pass  # different filesystem or no hard link support, keep the new copy
+    spool.persist(filepath)
@@ -0,0 +1,141 @@
+import os
+import json
+import base64
+from datetime import datetime, timezone
+from sqlalchemy import select, and_, or_
+
+# Page size of /api/cvs when the request asks for pagination without a "limit"
+CV_LIST_DEFAULT_LIMIT = int(os.getenv("CV_LIST_DEFAULT_LIMIT", 50))
+CV_LIST_MAX_LIMIT = int(os.getenv("CV_LIST_MAX_LIMIT", 500))
+
+# Fields of a listed CV, in UploadedCV.as_dict order
+CV_FIELDS = (
+    "id", "original_filename", "stored_filename", "filepath", "upload_time",
+    "group", "comment", "commented_at", "content_hash"
+)
+_DATETIME_FIELDS = ("upload_time", "commented_at")
+
+
+def encode_cursor(upload_time, cv_id):
+    payload = json.dumps([upload_time.isoformat(), cv_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """
+    Return the (upload_time, id) position encoded in a cursor; raises ValueError if it is malformed.
+    """
+    try:
+        upload_time, cv_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(upload_time), int(cv_id)
+    except (TypeError, ValueError, AttributeError, UnicodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def _parse_time(value, name):
+    try:
+        parsed = datetime.fromisoformat(str(value))
+    except ValueError as e:
+        raise ValueError(f"'{name}' must be an ISO 8601 date or datetime") from e
+    if parsed.tzinfo is not None:
+        # upload_time is stored as naive UTC
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def parse_list_options(data):
+    """
+    Validate the listing options of an /api/cvs request body. Returns the keyword arguments of
+    list_cvs (without the group) and whether the response is paginated; raises ValueError.
+    """
+    paginated = "limit" in data or "cursor" in data
+    options = {}
+
+    if paginated:
+        try:
+            limit = int(data.get("limit") or CV_LIST_DEFAULT_LIMIT)
+        except (TypeError, ValueError) as e:
+            raise ValueError("'limit' must be an integer") from e
+        options["limit"] = max(1, min(limit, CV_LIST_MAX_LIMIT))
+        if data.get("cursor"):
+            options["cursor"] = decode_cursor(data["cursor"])
+
+    fields = data.get("fields")
+    if fields:
+        if isinstance(fields, str):
+            fields = [field.strip() for field in fields.split(",") if field.strip()]
+        elif not isinstance(fields, list) or not all(isinstance(field, str) for field in fields):
+            raise ValueError("'fields' must be a comma-separated string or a list of field names")
+        unknown = [field for field in fields if field not in CV_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown field(s): {', '.join(map(str, unknown))}")
+        options["fields"] = fields
+
+    if data.get("has_comment") is not None:
+        options["has_comment"] = str(data["has_comment"]).lower() in ("1", "true", "yes")
+    if data.get("filename_prefix"):
+        options["filename_prefix"] = str(data["filename_prefix"])
+    if data.get("uploaded_from"):
+        options["uploaded_from"] = _parse_time(data["uploaded_from"], "uploaded_from")
+    if data.get("uploaded_to"):
+        options["uploaded_to"] = _parse_time(data["uploaded_to"], "uploaded_to")
+    return options, paginated
+
+
+def list_cvs(session, cv_table, group_table, group_name=None, fields=None, limit=None, cursor=None,
+             has_comment=None, filename_prefix=None, uploaded_from=None, uploaded_to=None):
+    """
+    List uploaded CVs newest first with one query that joins the group name and selects only the
+    requested fields. Pages are keyset-paginated on (upload_time, id): `cursor` is the position of
+    the last CV of the previous page. `uploaded_from` is inclusive, `uploaded_to` exclusive.
+    Returns (list of dicts, cursor of the next page or None).
+    """
+    fields = list(fields or CV_FIELDS)
+    columns = {name: cv_table.c[name] for name in CV_FIELDS if name != "group"}
+    columns["group"] = group_table.c.name
+    # The sort key is always selected, the cursor is built from it
+    selected = [columns[name].label(name) for name in fields if name not in ("id", "upload_time")]
+    stmt = select(cv_table.c.id, cv_table.c.upload_time, *selected).select_from(
+        cv_table.outerjoin(group_table, group_table.c.id == cv_table.c.group_id)
+    )
+
+    if group_name:
+        stmt = stmt.where(group_table.c.name == group_name)
+    if has_comment is not None:
+        has = and_(cv_table.c.comment.isnot(None), cv_table.c.comment != "")
+        stmt = stmt.where(has if has_comment else ~has)
+    if filename_prefix:
+        stmt = stmt.where(cv_table.c.original_filename.startswith(filename_prefix, autoescape=True))
+    if uploaded_from:
+        stmt = stmt.where(cv_table.c.upload_time >= uploaded_from)
+    if uploaded_to:
+        stmt = stmt.where(cv_table.c.upload_time < uploaded_to)
+    if cursor:
+        upload_time, cv_id = cursor
+        stmt = stmt.where(or_(
+            cv_table.c.upload_time < upload_time,
+            and_(cv_table.c.upload_time == upload_time, cv_table.c.id < cv_id)
+        ))
+
+    stmt = stmt.order_by(cv_table.c.upload_time.desc(), cv_table.c.id.desc())
+    if limit:
+        # One extra row tells whether there is a next page
+        stmt = stmt.limit(limit + 1)
+
+    rows = session.execute(stmt).all()
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].upload_time, rows[-1].id)
+
+    items = []
+    for row in rows:
+        values = row._mapping
+        item = {}
+        for name in fields:
+            value = values[name]
+            if name in _DATETIME_FIELDS and value is not None:
+                value = value.isoformat()
+            item[name] = value
+        items.append(item)
+    return items, next_cursor
@@ -1,31 +1,30 @@
 import os
 import re
-import uuid
 import json
+import threading
+import traceback
 import numpy as np
-from PyPDF2 import PdfReader
-from sentence_transformers import SentenceTransformer
 import faiss
-from docx import Document
+from utils.embedding_store import encode_cached
+from utils.extraction import extract_text, extract_texts, extract_text_from_pdf, extract_text_from_docx
+from utils.index_cache import invalidate_group
+from utils.locks import group_lock
+from utils import chunk_store, content_cache, lexical_index
+from utils.global_index import add_to_global_index, remove_from_global_index, rebuild_global_index, GLOBAL_INDEX_ENABLED
+from utils.index_factory import (
+    INDEX_TYPES, build_index, get_vectors_and_ids, index_type_of, is_cosine_index, is_legacy_index,
+    normalize, supports_remove, target_index_type, to_cosine_index, write_index
+)
 
 VECTOR_STORE_DIR = "vector_store"
 os.makedirs(VECTOR_STORE_DIR, exist_ok=True)
 
-model = SentenceTransformer('all-MiniLM-L6-v2')
-
-
-def extract_text_from_pdf(path):
-    reader = PdfReader(path)
-    text = ""
-    for page in reader.pages:
-        text += page.extract_text() + "\n"
-    return text
-
-def extract_text_from_docx(path):
-    doc = Document(path)
-    return "\n".join([para.text for para in doc.paragraphs if para.text.strip()])
-
+# Number of chunks per forward pass when encoding a batch of uploaded CVs
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 64))
 
+# Groups with a background index promotion in progress
+_promotions = set()
+_promotions_lock = threading.Lock()
 
 
 def clean_text(text):
@@ -54,11 +53,11 @@ def chunk_text(text, chunk_size=500):
     return chunks
 
 
-def create_chunks_with_metadata(chunks, filename, group):
+def create_chunks_with_metadata(chunks, filename, group, start_id=0):
     chunk_data = []
     for i, chunk in enumerate(chunks):
         metadata = {
-            "id": str(uuid.uuid4()),
+            "id": start_id + i,
             "chunk_index": i,
             "text": chunk,
             "source_file": filename,
@@ -68,95 +67,431 @@ def create_chunks_with_metadata(chunks, filename, group):
     return chunk_data
 
 
-def get_paths_for_group(group):
+def get_index_path(group):
     safe_group = group.replace(" ", "_").lower()
-    index_path = os.path.join(VECTOR_STORE_DIR, f"{safe_group}_faiss_index.index")
-    metadata_path = os.path.join(VECTOR_STORE_DIR, f"{safe_group}_chunk_metadata.json")
-    return index_path, metadata_path
+    return os.path.join(VECTOR_STORE_DIR, f"{safe_group}_faiss_index.index")
 
 
-def process_and_store_embeddings(pdf_path, original_filename, new_file_name, group="general"):
-    ext = original_filename.rsplit(".", 1)[-1].lower()
-    index_path, metadata_path = get_paths_for_group(group)
-    raw_text=""
-    print('type',ext)
-
-    if ext == "pdf":
-        raw_text = extract_text_from_pdf(pdf_path)
-    elif ext == "docx":
-        raw_text = extract_text_from_docx(pdf_path)
-    else:
-        raise ValueError("Unsupported file type")
+def get_legacy_metadata_path(group):
+    """
+    Per-group JSON metadata file used before chunk metadata moved to the chunk table.
+    """
+    safe_group = group.replace(" ", "_").lower()
+    return os.path.join(VECTOR_STORE_DIR, f"{safe_group}_chunk_metadata.json")
+
+
+def convert_to_id_mapped(index, metadata):
+    """
+    Convert a legacy positional IndexFlatL2 into an ID-mapped cosine index. Chunk IDs become
+    the row positions, which is exactly how the legacy index mapped rows to metadata.
+    Returns the new index and the metadata with int64 ids in place of the uuid4 strings.
+    """
+    vectors, ids = get_vectors_and_ids(index)
+    new_index = build_index("flat", normalize(vectors), ids, index.d)
 
+    for position, chunk in enumerate(metadata):
+        chunk["id"] = position
 
-    clean = clean_text(raw_text)
-    chunks = chunk_text(clean)
-    chunk_metadata = create_chunks_with_metadata(chunks, new_file_name, group)
+    return new_index, metadata
 
-    texts = [chunk["text"] for chunk in chunk_metadata]
-    embeddings = model.encode(texts)
-    embedding_matrix = np.array(embeddings).astype("float32")
+
+def migrate_group(group):
+    """
+    One-shot migration of a group to the current layout: an ID-mapped cosine FAISS index with
+    its chunk metadata in the chunk table. The legacy JSON file is kept as `*.json.migrated`.
+    Returns True if anything was migrated, False if the group was already up to date.
+    """
+    index_path = get_index_path(group)
+    metadata_path = get_legacy_metadata_path(group)
+    if not os.path.exists(index_path):
+        return False
+
+    index = faiss.read_index(index_path)
+    has_legacy_metadata = os.path.exists(metadata_path)
+    if not has_legacy_metadata and is_cosine_index(index):
+        return False
+
+    if has_legacy_metadata:
+        with open(metadata_path, "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+
+        if is_legacy_index(index):
+            if index.ntotal != len(metadata):
+                raise ValueError(
+                    f"Cannot migrate group '{group}': index has {index.ntotal} rows but metadata has {len(metadata)} entries"
+                )
+            index, metadata = convert_to_id_mapped(index, metadata)
+
+    if not is_cosine_index(index):
+        index = to_cosine_index(index)
+    write_index(index, index_path)
+
+    if has_legacy_metadata:
+        chunk_store.init_chunk_store()
+        with chunk_store.engine.begin() as conn:
+            # Replace rather than append so an interrupted migration can simply be re-run
+            chunk_store.delete_chunks_for_group(group, conn=conn)
+            chunk_store.add_chunks(group, metadata, conn=conn)
+        os.replace(metadata_path, metadata_path + ".migrated")
+
+    invalidate_group(group)
+    print(f"🔁 Migrated group '{group}' ({index.ntotal} chunks) to an ID-mapped cosine index and the chunk table")
+    return True
+
+
+def read_group_index(group):
+    """
+    Read a group's index and check its row count against the group's chunks in the chunk table.
+    A mismatch left by a worker that died between writing the index and committing its chunks
+    is repaired by rebuilding the index from the chunk table.
+    """
+    index_path = get_index_path(group)
+    index = faiss.read_index(index_path)
+    if os.path.exists(get_legacy_metadata_path(group)) or index.ntotal == chunk_store.count_chunks(group):
+        return index  # legacy chunks are only in the JSON file until the group is migrated
+
+    with group_lock(group):
+        # Re-check under the lock, the mismatch may be a write in progress in another worker
+        index = faiss.read_index(index_path) if os.path.exists(index_path) else None
+        stored = chunk_store.count_chunks(group)
+        if index is not None and index.ntotal == stored:
+            return index
+        print(f"⚠️ Group '{group}' index has {index.ntotal if index else 0} rows but {stored} chunks, rebuilding it")
+        if not rebuild_group_index(group):
+            raise FileNotFoundError(f"No FAISS index found for group '{group}'")
+        return faiss.read_index(index_path)
+
+
+def migrate_vector_store():
+    """
+    Migrate every group in `vector_store/` (legacy index files and JSON metadata) and
+    build the BM25 index of groups stored before it existed.
+    """
+    migrated = []
+    for filename in sorted(os.listdir(VECTOR_STORE_DIR)):
+        if filename.endswith("_faiss_index.index"):
+            group = filename[:-len("_faiss_index.index")]
+            with group_lock(group):
+                if migrate_group(group):
+                    migrated.append(group)
+            lexical_index.ensure_indexed(group)
+    return migrated
+
+
+def _file_ext(original_filename):
+    ext = original_filename.rsplit(".", 1)[-1].lower()
+    if ext not in ("pdf", "docx"):
+        raise ValueError("Unsupported file type")
+    return ext
+
+
+def _extract_clean_text(file_path, original_filename):
+    # Runs in the extraction process pool, with a per-file timeout
+    raw_text = extract_text(file_path, _file_ext(original_filename))
+    return clean_text(raw_text)
+
+
+def extract_cv_chunks(file_path, original_filename):
+    """
+    Extract, clean and chunk a CV. Returns the list of chunk texts.
+    """
+    return chunk_text(_extract_clean_text(file_path, original_filename))
+
+
+def _content_from_text(file_hash, clean):
+    text_hash = content_cache.hash_text(clean)
+    chunks = content_cache.get_by_text_hash(text_hash)
+    reused = "text" if chunks is not None else None
+    if chunks is None:
+        chunks = chunk_text(clean)
+    content_cache.store(file_hash, text_hash, chunks)
+    return {"file_hash": file_hash, "text_hash": text_hash, "chunks": chunks, "embeddings": None, "reused": reused}
+
+
+def load_cv_contents(files):
+    """
+    Chunk several CVs through the content cache, extracting all uncached files at once in the
+    extraction process pool. `files` is a list of (file_path, original_filename, file_hash),
+    `file_hash` being the sha256 of the file if already known (hashed while it was uploaded)
+    or None. Returns, in order, each file's content (see load_cv_content) or the exception
+    it raised.
+    """
+    contents = [None] * len(files)
+    to_extract = []  # (position, file_path, file_hash, ext)
+    for position, (file_path, original_filename, file_hash) in enumerate(files):
+        try:
+            file_hash = file_hash or content_cache.hash_file(file_path)
+            chunks = content_cache.get_by_file_hash(file_hash)
+            if chunks is not None:
+                contents[position] = {
+                    "file_hash": file_hash, "text_hash": None, "chunks": chunks, "embeddings": None, "reused": "file"
+                }
+                continue
+            to_extract.append((position, file_path, file_hash, _file_ext(original_filename)))
+        except Exception as e:
+            contents[position] = e
+
+    texts = extract_texts([(file_path, ext) for _, file_path, _, ext in to_extract])
+    for (position, _, file_hash, _), raw_text in zip(to_extract, texts):
+        if isinstance(raw_text, Exception):
+            contents[position] = raw_text
+            continue
+        try:
+            contents[position] = _content_from_text(file_hash, clean_text(raw_text))
+        except Exception as e:
+            contents[position] = e
+    return contents
+
+
+def load_cv_content(file_path, original_filename, file_hash=None):
+    """
+    Chunk a CV through the content cache. Returns a dict with `chunks`, `embeddings`
+    (None until embed_cv_contents runs), the content hashes and `reused`:
+    "file" if these exact bytes were ingested before (no extraction needed),
+    "text" if another file had the same cleaned text, else None. In both cases the chunks'
+    vectors come from the embedding store, without running the model.
+    `file_hash` is the sha256 of the file if already known (hashed while it was uploaded).
+    """
+    content = load_cv_contents([(file_path, original_filename, file_hash)])[0]
+    if isinstance(content, Exception):
+        raise content
+    return content
+
+
+def embed_cv_contents(contents, batch_size=EMBED_BATCH_SIZE):
+    """
+    Embed the chunks of every content (from load_cv_content) not embedded yet, in one batched
+    call; chunks already in the embedding store (e.g. of a re-uploaded file) are not re-encoded.
+    """
+    missing = [content for content in contents if content["embeddings"] is None and content["chunks"]]
+    if not missing:
+        return contents
+
+    encoded = encode_cached([text for content in missing for text in content["chunks"]], batch_size=batch_size)
+    offset = 0
+    for content in missing:
+        content["embeddings"] = encoded[offset:offset + len(content["chunks"])]
+        offset += len(content["chunks"])
+    return contents
+
+
+def store_embeddings_batch(extracted, group="general", batch_size=EMBED_BATCH_SIZE, keep=None):
+    """
+    Embed and store the chunks of several CVs of one group at once:
+    a single batched encode call, a single index append and a single metadata insert.
+    `extracted` is a list of (new_file_name, chunk_texts) pairs, or of
+    (new_file_name, chunk_texts, embeddings) to store already computed embeddings.
+    Files that already have chunks in the group are skipped, so storing twice (e.g. a job
+    re-run after a crash) adds nothing. `keep(new_file_names)`, if given, is called under the
+    group lock and returns the names still wanted; the others (CVs deleted meanwhile) are skipped.
+    Returns {new_file_name: chunk_metadata} of the files stored.
+    """
+    with group_lock(group):
+        names = [new_file_name for new_file_name, *_ in extracted]
+        wanted = set(names) - chunk_store.get_stored_files(group, names)
+        if keep is not None and wanted:
+            wanted &= set(keep(sorted(wanted)))
+        return _store_embeddings_batch([item for item in extracted if item[0] in wanted], group, batch_size)
+
+
+def _store_embeddings_batch(extracted, group, batch_size):
+    index_path = get_index_path(group)
+
+    migrate_group(group)
+
+    # Assign consecutive chunk ids across all files
+    next_id = chunk_store.next_faiss_id(group)
+    metadata_by_file = {}
+    all_metadata = []
+    embeddings_by_file = []  # (chunk_metadata, embeddings or None) per file
+    for new_file_name, chunks, *embeddings in extracted:
+        chunk_metadata = create_chunks_with_metadata(chunks, new_file_name, group, next_id)
+        next_id += len(chunk_metadata)
+        metadata_by_file[new_file_name] = chunk_metadata
+        all_metadata.extend(chunk_metadata)
+        if chunk_metadata:
+            embeddings_by_file.append((chunk_metadata, embeddings[0] if embeddings else None))
+
+    if not all_metadata:
+        return metadata_by_file
+
+    # One encode call for every chunk that does not come with its embedding
+    texts = [chunk["text"] for chunk_metadata, embeddings in embeddings_by_file if embeddings is None
+             for chunk in chunk_metadata]
+    encoded = encode_cached(texts, batch_size=batch_size) if texts else None
+    matrices, offset = [], 0
+    for chunk_metadata, embeddings in embeddings_by_file:
+        if embeddings is None:
+            embeddings = encoded[offset:offset + len(chunk_metadata)]
+            offset += len(chunk_metadata)
+        matrices.append(np.asarray(embeddings, dtype="float32"))
+    embedding_matrix = np.vstack(matrices)
+    chunk_ids = np.array([chunk["id"] for chunk in all_metadata], dtype="int64")
 
     # Load or create FAISS index
     if os.path.exists(index_path):
-        index = faiss.read_index(index_path)
+        index = read_group_index(group)
     else:
-        index = faiss.IndexFlatL2(embedding_matrix.shape[1])
+        index_type = target_index_type(group, len(chunk_ids))
+        index = build_index(index_type, embedding_matrix, np.zeros(0, dtype="int64"), embedding_matrix.shape[1])
 
-    index.add(embedding_matrix)
-    faiss.write_index(index, index_path)
+    index.add_with_ids(embedding_matrix, chunk_ids)
+    write_index(index, index_path)
+    add_to_global_index(group, embedding_matrix, chunk_ids)
 
-    # Append metadata
-    if os.path.exists(metadata_path):
-        with open(metadata_path, "r", encoding="utf-8") as f:
-            existing_metadata = json.load(f)
-    else:
-        existing_metadata = []
+    # Append metadata rows, no rewrite of existing chunks
+    chunk_store.add_chunks(group, all_metadata)
 
-    existing_metadata.extend(chunk_metadata)
+    invalidate_group(group)
+    maybe_promote_index(group, index)
 
-    with open(metadata_path, "w", encoding="utf-8") as f:
-        json.dump(existing_metadata, f, indent=2)
+    print(f"📥 Stored {len(all_metadata)} chunks from {len(metadata_by_file)} file(s) under group '{group}'")
+    return metadata_by_file
 
-    print(f"📥 Stored {len(chunk_metadata)} chunks from {original_filename} ({new_file_name}) under group '{group}'")
-    return chunk_metadata
+
+def process_and_store_embeddings(pdf_path, original_filename, new_file_name, group="general"):
+    chunks = extract_cv_chunks(pdf_path, original_filename)
+    stored = store_embeddings_batch([(new_file_name, chunks)], group)
+    return stored[new_file_name]
 
 
 def delete_cv_data(new_file_name, group="general"):
     print(f"🗑 Deleting CV data for: {new_file_name} under group '{group}'")
-    index_path, metadata_path = get_paths_for_group(group)
+    with group_lock(group):
+        _delete_cv_data(new_file_name, group)
 
-    if not os.path.exists(index_path) or not os.path.exists(metadata_path):
-        print("No index or metadata file found.")
-        return
 
-    with open(metadata_path, "r", encoding="utf-8") as f:
-        all_metadata = json.load(f)
+def _delete_cv_data(new_file_name, group):
+    index_path = get_index_path(group)
 
-    # Filter out chunks for the CV
-    remaining_metadata = []
-    for chunk in all_metadata:
-        if chunk["source_file"] != new_file_name:
-            remaining_metadata.append(chunk)
+    migrate_group(group)
 
-    if len(remaining_metadata) == len(all_metadata):
+    if not os.path.exists(index_path):
+        print("No index file found.")
+        return
+
+    removed_ids = chunk_store.get_faiss_ids_for_file(group, new_file_name)
+    if not removed_ids:
         print("No chunks found to delete.")
         return
 
-    # Rebuild index
-    print(f"🔄 Rebuilding FAISS index after deletion...")
+    # Remove this CV's vectors by chunk id, no re-embedding needed
+    index = read_group_index(group)
+    removed = np.array(removed_ids, dtype="int64")
+    if supports_remove(index):
+        index.remove_ids(removed)
+    else:
+        vectors, ids = get_vectors_and_ids(index)
+        keep = ~np.isin(ids, removed)
+        index = build_index(index_type_of(index), vectors[keep], ids[keep], index.d)
 
-    texts = [m["text"] for m in remaining_metadata]
-    if texts:
-        embeddings = model.encode(texts, show_progress_bar=False)
-        new_index = faiss.IndexFlatL2(embeddings.shape[1])
-        new_index.add(np.array(embeddings).astype("float32"))
-        faiss.write_index(new_index, index_path)
+    if index.ntotal:
+        write_index(index, index_path)
     else:
         os.remove(index_path)
         print("All embeddings deleted, FAISS index removed.")
+    remove_from_global_index(group, removed_ids)
 
-    with open(metadata_path, "w", encoding="utf-8") as f:
-        json.dump(remaining_metadata, f, indent=2)
+    chunk_store.delete_chunks_for_file(group, new_file_name)
+
+    invalidate_group(group)
 
     print("✅ Deleted metadata and updated FAISS index.")
+
+
+def rebuild_group_index(group, batch_size=EMBED_BATCH_SIZE):
+    """
+    Rebuild a group's index from the chunk table, e.g. after changing EMBEDDING_MODEL or
+    INDEX_TYPE. Embeddings come from the embedding store where present, so only chunks never
+    embedded with the current model go through the model. Returns the number of chunks indexed.
+    """
+    rows = chunk_store.get_group_chunks(group)
+    index_path = get_index_path(group)
+    with group_lock(group):
+        if not rows:
+            if os.path.exists(index_path):
+                os.remove(index_path)
+            invalidate_group(group)
+            return 0
+        ids = np.array([faiss_id for faiss_id, _ in rows], dtype="int64")
+        vectors = encode_cached([text for _, text in rows], batch_size=batch_size)
+        index = build_index(target_index_type(group, len(ids)), vectors, ids, vectors.shape[1])
+        write_index(index, index_path)
+        invalidate_group(group)
+    print(f"🔁 Rebuilt {index_type_of(index)} index for group '{group}' ({len(ids)} chunks)")
+    return len(ids)
+
+
+def maybe_promote_index(group, index):
+    """
+    Start a background rebuild of the group's index if it has outgrown its current type
+    (flat -> hnsw -> ivfpq). Searches keep using the current index until the new one is swapped in.
+    """
+    current = index_type_of(index)
+    target = target_index_type(group, index.ntotal)
+    if INDEX_TYPES.index(target) <= INDEX_TYPES.index(current):
+        return
+
+    key = group.replace(" ", "_").lower()
+    with _promotions_lock:
+        if key in _promotions:
+            return
+        _promotions.add(key)
+
+    threading.Thread(target=_promote_index, args=(group, target), name=f"promote-{key}", daemon=True).start()
+
+
+def _promote_index(group, index_type):
+    key = group.replace(" ", "_").lower()
+    index_path = get_index_path(group)
+    try:
+        with group_lock(group):
+            snapshot = faiss.read_index(index_path)
+        vectors, ids = get_vectors_and_ids(snapshot)
+
+        # Training / graph construction happens without holding the group lock
+        print(f"🏗 Building {index_type} index for group '{group}' ({len(ids)} chunks)")
+        promoted = build_index(index_type, vectors, ids, snapshot.d)
+
+        with group_lock(group):
+            if not os.path.exists(index_path):
+                return
+            current_vectors, current_ids = get_vectors_and_ids(faiss.read_index(index_path))
+
+            # Catch up with uploads and deletes that happened while we were building
+            added = ~np.isin(current_ids, ids)
+            removed = ids[~np.isin(ids, current_ids)]
+            if added.any():
+                promoted.add_with_ids(current_vectors[added], current_ids[added])
+            if len(removed):
+                if supports_remove(promoted):
+                    promoted.remove_ids(removed)
+                else:
+                    promoted = build_index(index_type, current_vectors, current_ids, snapshot.d)
+
+            write_index(promoted, index_path)
+            invalidate_group(group)
+        print(f"✅ Group '{group}' now uses a {index_type} index")
+    except Exception:
+        print(f"Index promotion failed for group '{group}': {traceback.format_exc()}")
+    finally:
+        with _promotions_lock:
+            _promotions.discard(key)
+
+
+if __name__ == "__main__":
+    # One-shot migration: python -m utils.cv_processing [--reindex]
+    import argparse
+    parser = argparse.ArgumentParser(description="Migrate the vector store to the current layout")
+    parser.add_argument("--reindex", action="store_true",
+                        help="also rebuild every group's index from the chunk table and the embedding store")
+    args = parser.parse_args()
+
+    migrated_groups = migrate_vector_store()
+    print(f"✅ Migrated {len(migrated_groups)} group(s): {', '.join(migrated_groups) or '-'}")
+    if args.reindex:
+        for filename in sorted(os.listdir(VECTOR_STORE_DIR)):
+            if filename.endswith("_faiss_index.index"):
+                rebuild_group_index(filename[:-len("_faiss_index.index")])
+    if GLOBAL_INDEX_ENABLED:
+        rebuild_global_index()
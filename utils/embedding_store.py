@@ -0,0 +1,138 @@
+import os
+import re
+import fcntl
+import hashlib
+import threading
+import numpy as np
+from sqlalchemy import Table, Column, Integer, BigInteger, String, Index, select, insert
+from utils.db import engine, metadata, init_db
+from utils.embeddings import EMBEDDING_MODEL_NAME, encode
+
+# Persist every computed chunk embedding, so re-indexing never has to run the model again
+EMBEDDING_STORE_ENABLED = os.getenv("EMBEDDING_STORE_ENABLED", "true").lower() in ("1", "true", "yes")
+EMBEDDING_STORE_DIR = os.getenv("EMBEDDING_STORE_DIR", os.path.join("vector_store", "embeddings"))
+
+# Row of each stored embedding in its model's append-only float32 matrix file
+embedding_offset_table = Table(
+    "embedding_offset", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("model", String(255), nullable=False),
+    Column("text_hash", String(64), nullable=False),
+    Column("row", BigInteger, nullable=False),
+    Column("dim", Integer, nullable=False),
+    Index("ix_embedding_offset_model_hash", "model", "text_hash", unique=True),
+)
+
+# SQLite limits the number of bound parameters per statement
+_LOOKUP_BATCH = 500
+
+_matrices = {}  # path -> read-only memmap, reopened when the file has grown
+_matrices_lock = threading.Lock()
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _matrix_path(model):
+    return os.path.join(EMBEDDING_STORE_DIR, re.sub(r"[^A-Za-z0-9_.-]", "_", model) + ".f32")
+
+
+def _read_rows(model, rows, dim):
+    path = _matrix_path(model)
+    needed = max(rows) + 1
+    with _matrices_lock:
+        matrix = _matrices.get(path)
+        if matrix is None or matrix.shape[0] < needed or matrix.shape[1] != dim:
+            # Map complete rows only: the file may end in a row another process is appending,
+            # or in a partial row left by a crashed append (dropped by the next append)
+            matrix = np.memmap(path, dtype="float32", mode="r", shape=(os.path.getsize(path) // (dim * 4), dim))
+            _matrices[path] = matrix
+    return np.array(matrix[np.asarray(rows)])
+
+
+def get_embeddings(hashes, model=EMBEDDING_MODEL_NAME):
+    """
+    Return {text_hash: vector} for the hashes that are stored for `model`.
+    """
+    hashes = list(dict.fromkeys(hashes))
+    if not hashes:
+        return {}
+    init_db()
+    found = {}
+    with engine.connect() as conn:
+        for start in range(0, len(hashes), _LOOKUP_BATCH):
+            found.update({
+                row.text_hash: (row.row, row.dim)
+                for row in conn.execute(select(embedding_offset_table).where(
+                    embedding_offset_table.c.model == model,
+                    embedding_offset_table.c.text_hash.in_(hashes[start:start + _LOOKUP_BATCH])
+                ))
+            })
+    if not found:
+        return {}
+
+    dim = next(iter(found.values()))[1]
+    keys = list(found)
+    vectors = _read_rows(model, [found[key][0] for key in keys], dim)
+    return dict(zip(keys, vectors))
+
+
+def put_embeddings(hashes, vectors, model=EMBEDDING_MODEL_NAME):
+    """
+    Append embeddings that are not stored yet. Rows are written to the matrix file before
+    their offsets are recorded, so a crash can only leave unreferenced rows behind.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    if not len(hashes):
+        return
+    init_db()
+    os.makedirs(EMBEDDING_STORE_DIR, exist_ok=True)
+    path = _matrix_path(model)
+    dim = vectors.shape[1]
+
+    with open(path + ".lock", "w") as lock_file:
+        # Serializes appends across processes
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        stored = get_embeddings(hashes, model)
+        new = {}
+        for key, vector in zip(hashes, vectors):
+            if key not in stored and key not in new:
+                new[key] = vector
+        if not new:
+            return
+
+        with open(path, "ab") as f:
+            # Drop a partial row left by an interrupted write
+            size = f.seek(0, os.SEEK_END)
+            if size % (dim * 4):
+                size = f.truncate(size - size % (dim * 4))
+            first_row = size // (dim * 4)
+            f.write(np.vstack(list(new.values())).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        with engine.begin() as conn:
+            conn.execute(insert(embedding_offset_table), [
+                {"model": model, "text_hash": key, "row": first_row + i, "dim": dim}
+                for i, key in enumerate(new)
+            ])
+
+
+def encode_cached(texts, batch_size=32):
+    """
+    Drop-in for embeddings.encode that only runs the model for texts whose embedding is
+    not in the store yet, and stores those.
+    """
+    if not EMBEDDING_STORE_ENABLED or not texts:
+        return encode(texts, batch_size=batch_size)
+
+    hashes = [text_hash(text) for text in texts]
+    stored = get_embeddings(hashes)
+    # First position of each distinct text that still has to go through the model
+    missing = list({key: i for i, key in reversed(list(enumerate(hashes))) if key not in stored}.values())
+    if missing:
+        encoded = encode([texts[i] for i in missing], batch_size=batch_size)
+        put_embeddings([hashes[i] for i in missing], encoded)
+        stored.update(zip((hashes[i] for i in missing), encoded))
+    return np.vstack([stored[key] for key in hashes]).astype("float32")
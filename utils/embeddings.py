@@ -0,0 +1,41 @@
+import os
+import threading
+import numpy as np
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_model():
+    """
+    Return the process-wide SentenceTransformer, loading it on first use.
+    torch and sentence_transformers are only imported here, so importing the app stays cheap.
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                from sentence_transformers import SentenceTransformer
+                _model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    return _model
+
+
+def preload_model():
+    """
+    Load the model now, e.g. in the gunicorn master before workers fork so that
+    they share its pages copy-on-write instead of each loading their own copy.
+    """
+    get_model()
+
+
+def encode(texts, batch_size=32):
+    """
+    Embed a list of texts as a float32 matrix of shape (len(texts), dim) with unit-length
+    rows, so that inner product scores are cosine similarities.
+    """
+    embeddings = get_model().encode(texts, batch_size=batch_size, show_progress_bar=False)
+    embeddings = np.array(embeddings).astype("float32")
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
@@ -0,0 +1,223 @@
+import io
+import os
+import mmap
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from PyPDF2 import PdfReader
+from docx import Document
+
+logger = logging.getLogger(__name__)
+
+# Worker processes used for PDF/DOCX text extraction (CPU-bound, holds the GIL)
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", os.cpu_count() or 2))
+# Seconds a single file may take, from when a worker starts on it, before that worker is killed
+EXTRACT_TIMEOUT = float(os.getenv("EXTRACT_TIMEOUT", 60))
+# How worker processes are started: "forkserver" (where available) or "spawn"
+EXTRACT_START_METHOD = os.getenv("EXTRACT_START_METHOD", "forkserver")
+
+_context = None
+_idle = []  # started workers waiting for a file
+_idle_lock = threading.Lock()
+# One file per worker at a time, across all threads: a file waiting for a free worker is not
+# on the clock yet
+_slots = threading.BoundedSemaphore(EXTRACT_WORKERS)
+
+
+def extract_text_from_pdf(path):
+    # An empty file cannot be mapped; PdfReader rejects it (EmptyFileError) like any unreadable PDF
+    if isinstance(path, (str, os.PathLike)) and os.path.getsize(path) > 0:
+        # Map the file instead of PdfReader's read of the whole file into a private buffer;
+        # the pages read are shared with the page cache
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            return extract_text_from_pdf(buffer)
+    reader = PdfReader(path)
+    return "\n".join((page.extract_text() or "") for page in reader.pages) + "\n"
+
+def extract_text_from_docx(path):
+    doc = Document(path)
+    return "\n".join([para.text for para in doc.paragraphs if para.text.strip()])
+
+
+def _extract(source, ext):
+    """
+    Runs inside a pool worker. `source` is a file path or the raw file bytes.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+
+    if ext == "pdf":
+        return extract_text_from_pdf(source)
+    elif ext == "docx":
+        return extract_text_from_docx(source)
+    else:
+        raise ValueError("Unsupported file type")
+
+
+def _worker_loop(conn):
+    """
+    Main loop of a worker process: extract each (source, ext) received on `conn` and send back
+    (True, text) or (False, exception).
+    """
+    conn.send(os.getpid())  # ready
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        try:
+            reply = (True, _extract(*task))
+        except Exception as e:
+            reply = (False, e)
+        try:
+            conn.send(reply)
+        except Exception:
+            # The extraction's exception could not be pickled
+            conn.send((False, RuntimeError(f"Text extraction failed: {reply[1]!r}")))
+
+
+class _WorkerDied(Exception):
+    pass
+
+
+class _Worker:
+    """
+    One extraction process with a pipe of its own, so that killing it (e.g. stuck on a
+    pathological PDF) does not affect the files the other workers are extracting.
+    """
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_loop, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        try:
+            self.conn.recv()
+        except EOFError:
+            self.close()
+            raise RuntimeError("Text extraction worker failed to start")
+
+    def run(self, source, ext, timeout):
+        """
+        Extract one file and return (ok, text or exception). Raises TimeoutError if the
+        worker takes longer than `timeout` seconds and _WorkerDied if it exited.
+        """
+        try:
+            self.conn.send((source, ext))
+            done = self.conn.poll(timeout)
+            if done:
+                return self.conn.recv()
+        except (EOFError, OSError) as e:
+            raise _WorkerDied() from e
+        raise TimeoutError(f"Text extraction timed out after {timeout:g}s")
+
+    def close(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+def _mp_context():
+    # Not "fork": workers are started while request, ingest and HTTP client threads run, and
+    # a forked child can deadlock on a lock one of them held. The fork server is a clean process
+    # that has only imported this module (and the main script); workers are forked from it.
+    global _context
+    if _context is None:
+        if EXTRACT_START_METHOD in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context(EXTRACT_START_METHOD)
+        else:
+            context = multiprocessing.get_context("spawn")
+        if context.get_start_method() == "forkserver":
+            context.set_forkserver_preload(["__main__", __name__])
+        _context = context
+    return _context
+
+
+def _acquire_worker():
+    with _idle_lock:
+        while _idle:
+            worker = _idle.pop()
+            if worker.process.is_alive():
+                return worker
+            worker.close()
+    return _Worker(_mp_context())
+
+
+def _release_worker(worker):
+    with _idle_lock:
+        _idle.append(worker)
+
+
+def warm_up_extraction_pool():
+    """
+    Start every worker process now rather than on the first upload.
+    """
+    with _idle_lock:
+        missing = EXTRACT_WORKERS - len(_idle)
+    workers = [_Worker(_mp_context()) for _ in range(missing)]
+    with _idle_lock:
+        _idle.extend(workers)
+
+
+def shutdown_extraction_pool():
+    with _idle_lock:
+        workers = list(_idle)
+        _idle.clear()
+    for worker in workers:
+        worker.close()
+
+
+def extract_text(source, ext, timeout=EXTRACT_TIMEOUT):
+    """
+    Extract text from a PDF/DOCX in an extraction worker process.
+    `source` is a path or the file bytes (so uploads never need to hit disk).
+    Raises TimeoutError if the file takes longer than `timeout` seconds once a worker has it.
+    """
+    ext = ext.lower().lstrip(".")
+
+    with _slots:
+        for attempt in range(2):
+            worker = _acquire_worker()
+            try:
+                ok, result = worker.run(source, ext, timeout)
+            except TimeoutError:
+                logger.error("Text extraction timed out after %ss, killing its worker", timeout)
+                worker.close()
+                raise
+            except _WorkerDied:
+                worker.close()
+                # An idle worker may have been killed (e.g. by the OOM killer); retry once
+                if attempt:
+                    raise RuntimeError("Text extraction worker died")
+                continue
+            except BaseException:
+                worker.close()
+                raise
+            _release_worker(worker)
+            if ok:
+                return result
+            raise result
+
+
+def extract_texts(sources, timeout=EXTRACT_TIMEOUT):
+    """
+    Extract several files concurrently. `sources` is a list of (path or bytes, ext).
+    Returns, in order, the text of each file or the exception its extraction raised.
+    """
+    if not sources:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(len(sources), EXTRACT_WORKERS)) as threads:
+        futures = [threads.submit(extract_text, source, ext, timeout) for source, ext in sources]
+
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append(e)
+    return results
@@ -0,0 +1,155 @@
+import os
+import numpy as np
+import faiss
+from utils import chunk_store
+from utils.index_cache import index_cache, invalidate_group
+from utils.index_factory import get_vectors_and_ids, is_cosine_index, normalize, write_index
+from utils.locks import group_lock
+
+VECTOR_STORE_DIR = "vector_store"
+GLOBAL_INDEX_PATH = os.path.join(VECTOR_STORE_DIR, "global_faiss.index")
+GLOBAL_CACHE_KEY = "__global__"
+
+# Keep one index over the chunks of every group, so "all groups" search is a single query
+GLOBAL_INDEX_ENABLED = os.getenv("GLOBAL_INDEX_ENABLED", "false").lower() in ("1", "true", "yes")
+
+# Global id = (group slot << GROUP_ID_BITS) | per-group faiss id, so each group owns one id range
+GROUP_ID_BITS = 40
+
+
+def to_global_ids(group, faiss_ids):
+    slot = chunk_store.get_group_slot(group)
+    return (np.int64(slot) << GROUP_ID_BITS) | np.asarray(faiss_ids, dtype="int64")
+
+
+def split_global_id(global_id):
+    """
+    Return (group, faiss_id) for a global id.
+    """
+    global_id = int(global_id)
+    return chunk_store.get_group_for_slot(global_id >> GROUP_ID_BITS), global_id & ((1 << GROUP_ID_BITS) - 1)
+
+
+def group_selector(groups):
+    """
+    FAISS selector that only admits ids from the given groups' id ranges.
+    """
+    selectors = []
+    for group in groups:
+        slot = chunk_store.get_group_slot(group)
+        selectors.append(faiss.IDSelectorRange(slot << GROUP_ID_BITS, (slot + 1) << GROUP_ID_BITS))
+
+    selector = selectors[0]
+    for other in selectors[1:]:
+        selector = faiss.IDSelectorOr(selector, other)
+    # keep the Python wrappers of the combined selectors alive as long as the result
+    selector.referenced_objects = selectors
+    return selector
+
+
+def _read_group_index(path):
+    """
+    Return (normalized vectors, faiss_ids) stored in a group's index file.
+    """
+    vectors, ids = get_vectors_and_ids(faiss.read_index(path))
+    return normalize(vectors), ids
+
+
+def global_lock():
+    """
+    Lock serializing writes to the global index file; taken after a group's lock, never before.
+    """
+    return group_lock(GLOBAL_CACHE_KEY)
+
+
+def rebuild_global_index():
+    """
+    Build the global index from the per-group index files.
+    """
+    with global_lock():
+        return _rebuild_global_index()
+
+
+def _rebuild_global_index():
+    global_index = None
+    for filename in sorted(os.listdir(VECTOR_STORE_DIR)):
+        if not filename.endswith("_faiss_index.index"):
+            continue
+        group = filename[:-len("_faiss_index.index")]
+        vectors, ids = _read_group_index(os.path.join(VECTOR_STORE_DIR, filename))
+        if global_index is None:
+            global_index = faiss.IndexIDMap2(faiss.IndexFlatIP(vectors.shape[1]))
+        if len(ids):
+            global_index.add_with_ids(vectors, to_global_ids(group, ids))
+
+    if global_index is None or not global_index.ntotal:
+        if os.path.exists(GLOBAL_INDEX_PATH):
+            os.remove(GLOBAL_INDEX_PATH)
+    else:
+        write_index(global_index, GLOBAL_INDEX_PATH)
+
+    invalidate_group(GLOBAL_CACHE_KEY)
+    print(f"🌐 Rebuilt global FAISS index ({global_index.ntotal if global_index else 0} chunks)")
+    return global_index
+
+
+def add_to_global_index(group, embedding_matrix, faiss_ids):
+    if not GLOBAL_INDEX_ENABLED:
+        return
+    with global_lock():
+        _add_to_global_index(group, embedding_matrix, faiss_ids)
+
+
+def _add_to_global_index(group, embedding_matrix, faiss_ids):
+    if not os.path.exists(GLOBAL_INDEX_PATH):
+        # The group's own index already holds the new vectors, so this picks them up too
+        _rebuild_global_index()
+        return
+
+    index = faiss.read_index(GLOBAL_INDEX_PATH)
+    if not is_cosine_index(index):
+        _rebuild_global_index()
+        return
+    index.add_with_ids(embedding_matrix, to_global_ids(group, faiss_ids))
+    write_index(index, GLOBAL_INDEX_PATH)
+    invalidate_group(GLOBAL_CACHE_KEY)
+
+
+def remove_from_global_index(group, faiss_ids):
+    if not GLOBAL_INDEX_ENABLED:
+        return
+    with global_lock():
+        _remove_from_global_index(group, faiss_ids)
+
+
+def _remove_from_global_index(group, faiss_ids):
+    if not os.path.exists(GLOBAL_INDEX_PATH):
+        return
+
+    index = faiss.read_index(GLOBAL_INDEX_PATH)
+    if not is_cosine_index(index):
+        _rebuild_global_index()
+        return
+    index.remove_ids(to_global_ids(group, faiss_ids))
+    if index.ntotal:
+        write_index(index, GLOBAL_INDEX_PATH)
+    else:
+        os.remove(GLOBAL_INDEX_PATH)
+    invalidate_group(GLOBAL_CACHE_KEY)
+
+
+def load_global_index():
+    """
+    Return the (cached) global index, building it first if it does not exist yet.
+    Returns None when there is nothing indexed.
+    """
+    if not os.path.exists(GLOBAL_INDEX_PATH):
+        rebuild_global_index()
+        if not os.path.exists(GLOBAL_INDEX_PATH):
+            return None
+
+    index = index_cache.get(GLOBAL_CACHE_KEY, (GLOBAL_INDEX_PATH,), lambda: faiss.read_index(GLOBAL_INDEX_PATH))
+    if not is_cosine_index(index):
+        # Built with L2 scoring by an older version
+        index = rebuild_global_index()
+    return index
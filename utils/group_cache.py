@@ -0,0 +1,45 @@
+import os
+import time
+import threading
+
+# Seconds a worker trusts its group map; bounds how long groups created or deleted by another
+# worker take to show up here
+GROUP_CACHE_TTL = float(os.getenv("GROUP_CACHE_TTL", 60))
+
+
+class GroupMap:
+    """
+    In-memory group name -> id map, loaded with one query by `loader()` (returning (name, id)
+    rows) and shared by the request threads of this process. Invalidated on group create/delete;
+    a name missing from the map triggers one reload, so new groups are found right away.
+    """
+
+    def __init__(self, loader, ttl=GROUP_CACHE_TTL):
+        self.loader = loader
+        self.ttl = ttl
+        self._ids = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _current(self, reload=False):
+        with self._lock:
+            if reload or self._ids is None or time.monotonic() - self._loaded_at > self.ttl:
+                self._ids = {name: group_id for name, group_id in self.loader()}
+                self._loaded_at = time.monotonic()
+            return self._ids
+
+    def get_id(self, name):
+        """
+        Return the id of the group called `name`, or None if there is no such group.
+        """
+        group_id = self._current().get(name)
+        if group_id is None:
+            group_id = self._current(reload=True).get(name)
+        return group_id
+
+    def names(self):
+        return list(self._current())
+
+    def invalidate(self):
+        with self._lock:
+            self._ids = None
@@ -0,0 +1,96 @@
+import os
+import threading
+from collections import OrderedDict
+
+# Upper bound on the memory held by cached indexes, in bytes.
+INDEX_CACHE_MAX_BYTES = int(os.getenv("INDEX_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+
+def _file_key(paths):
+    """
+    Build a cache key from the (mtime, size) of every backing file, so that a write
+    from another worker process is picked up on the next lookup.
+    """
+    key = []
+    for path in paths:
+        st = os.stat(path)
+        key.append((st.st_mtime_ns, st.st_size))
+    return tuple(key)
+
+
+class IndexCache:
+    """
+    Process-wide LRU cache of loaded FAISS indexes, per group.
+    Entries are evicted least-recently-used first once the memory budget is exceeded.
+    """
+
+    def __init__(self, max_bytes=INDEX_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()  # group -> (key, version, value, size)
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, group, paths, loader):
+        """
+        Return the cached value for `group`, calling `loader()` on a miss or when
+        the backing files changed since it was loaded.
+        """
+        key = _file_key(paths)
+
+        with self._lock:
+            version = self._versions.get(group, 0)
+            entry = self._entries.get(group)
+            if entry and entry[0] == key and entry[1] == version:
+                self._entries.move_to_end(group)
+                return entry[2]
+
+        value = loader()
+        size = sum(size for _, size in key)
+
+        with self._lock:
+            # Don't cache a value that was invalidated while we were loading it
+            if self._versions.get(group, 0) != version:
+                return value
+
+            self._drop(group)
+            if size <= self.max_bytes:
+                self._entries[group] = (key, version, value, size)
+                self.current_bytes += size
+                while self.current_bytes > self.max_bytes:
+                    oldest = next(iter(self._entries))
+                    self._drop(oldest)
+
+        return value
+
+    def invalidate(self, group):
+        with self._lock:
+            self._versions[group] = self._versions.get(group, 0) + 1
+            self._drop(group)
+
+    def clear(self):
+        with self._lock:
+            for group in list(self._entries):
+                self._versions[group] = self._versions.get(group, 0) + 1
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def _drop(self, group):
+        entry = self._entries.pop(group, None)
+        if entry:
+            self.current_bytes -= entry[3]
+
+
+index_cache = IndexCache()
+
+
+def cache_key_for_group(group):
+    return group.replace(" ", "_").lower()
+
+
+def invalidate_group(group):
+    index_cache.invalidate(cache_key_for_group(group))
+
+
+def clear_index_cache():
+    index_cache.clear()
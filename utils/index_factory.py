@@ -0,0 +1,213 @@
+import os
+import json
+import math
+import numpy as np
+import faiss
+
+# Index type for every group: "auto" (flat, promoted to hnsw / ivfpq as the group grows),
+# or a fixed "flat", "hnsw" or "ivfpq"
+INDEX_TYPE = os.getenv("INDEX_TYPE", "auto").lower()
+# Per-group overrides, e.g. GROUP_INDEX_TYPES='{"qa_team": "flat", "engineering": "ivfpq"}'
+GROUP_INDEX_TYPES = {
+    group.replace(" ", "_").lower(): index_type.lower()
+    for group, index_type in json.loads(os.getenv("GROUP_INDEX_TYPES", "{}")).items()
+}
+
+# Chunk counts at which "auto" groups are promoted
+HNSW_PROMOTE_AT = int(os.getenv("HNSW_PROMOTE_AT", 20000))
+IVFPQ_PROMOTE_AT = int(os.getenv("IVFPQ_PROMOTE_AT", 200000))
+
+HNSW_M = int(os.getenv("HNSW_M", 32))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", 80))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", 64))
+
+IVFPQ_M = int(os.getenv("IVFPQ_M", 48))  # PQ sub-quantizers, must divide the embedding dimension
+# Groups configured as "ivfpq" stay flat until they have enough vectors to train on
+IVFPQ_MIN_TRAINING = int(os.getenv("IVFPQ_MIN_TRAINING", 10000))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", 16))
+
+INDEX_TYPES = ("flat", "hnsw", "ivfpq")
+
+
+def configured_index_type(group):
+    return GROUP_INDEX_TYPES.get(group.replace(" ", "_").lower(), INDEX_TYPE)
+
+
+def target_index_type(group, ntotal):
+    """
+    Index type a group with `ntotal` chunks should use.
+    """
+    index_type = configured_index_type(group)
+    if index_type == "ivfpq":
+        return "ivfpq" if ntotal >= IVFPQ_MIN_TRAINING else "flat"
+    if index_type != "auto":
+        return index_type
+    if ntotal >= max(IVFPQ_PROMOTE_AT, IVFPQ_MIN_TRAINING):
+        return "ivfpq"
+    if ntotal >= HNSW_PROMOTE_AT:
+        return "hnsw"
+    return "flat"
+
+
+def index_type_of(index):
+    if isinstance(index, faiss.IndexIVF):
+        return "ivfpq"
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        inner = faiss.downcast_index(index.index)
+        return "hnsw" if isinstance(inner, faiss.IndexHNSW) else "flat"
+    return "flat"
+
+
+def is_legacy_index(index):
+    """
+    Positional IndexFlatL2 from before indexes carried chunk ids.
+    """
+    return isinstance(index, faiss.IndexFlat)
+
+
+def is_cosine_index(index):
+    """
+    Indexes score by inner product over L2-normalized vectors, i.e. cosine similarity.
+    Older groups were built with L2 distance over raw embeddings.
+    """
+    return index.metric_type == faiss.METRIC_INNER_PRODUCT
+
+
+def supports_remove(index):
+    # HNSW graphs cannot drop nodes, those indexes are rebuilt from their stored vectors instead
+    return index_type_of(index) != "hnsw"
+
+
+def new_index(index_type, dim, training_vectors=None):
+    """
+    Create an empty inner-product index that maps vectors to int64 chunk ids.
+    IVF-PQ has to be trained, on `training_vectors`.
+    """
+    if index_type == "flat":
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+
+    if index_type == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        hnsw.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        hnsw.hnsw.efSearch = HNSW_EF_SEARCH
+        return faiss.IndexIDMap2(hnsw)
+
+    if index_type == "ivfpq":
+        if training_vectors is None or not len(training_vectors):
+            raise ValueError("IVF-PQ index needs training vectors")
+        # IVF indexes keep their own ids (and remove_ids keeps them consistent), no IDMap needed
+        nlist = max(1, min(int(4 * math.sqrt(len(training_vectors))), len(training_vectors) // 39))
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, IVFPQ_M, 8, faiss.METRIC_INNER_PRODUCT)
+        index.train(training_vectors)
+        index.nprobe = IVF_NPROBE
+        index.referenced_objects = [quantizer]
+        return index
+
+    raise ValueError(f"Unknown index type '{index_type}'")
+
+
+def build_index(index_type, vectors, ids, dim):
+    index = new_index(index_type, dim, training_vectors=vectors)
+    if len(ids):
+        index.add_with_ids(vectors, ids)
+    return index
+
+
+def normalize(vectors):
+    """
+    L2-normalize rows in place (a no-op for rows that already are), returns the matrix.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def to_cosine_index(index):
+    """
+    Rebuild an L2 index of the same type as a cosine index, from its normalized stored vectors.
+    """
+    vectors, ids = get_vectors_and_ids(index)
+    return build_index(index_type_of(index), normalize(vectors), ids, index.d)
+
+
+def get_vectors_and_ids(index):
+    """
+    Return (vectors, ids) of everything stored in an index. IVF-PQ vectors are the
+    (lossy) decoded codes.
+    """
+    if not index.ntotal:
+        return np.zeros((0, index.d), dtype="float32"), np.zeros(0, dtype="int64")
+
+    if is_legacy_index(index):
+        # Legacy positional index: its chunk ids are the row positions (see migrate_group)
+        return index.reconstruct_n(0, index.ntotal), np.arange(index.ntotal, dtype="int64")
+
+    if isinstance(index, faiss.IndexIVF):
+        invlists = index.invlists
+        ids = np.concatenate([
+            faiss.rev_swig_ptr(invlists.get_ids(list_no), invlists.list_size(list_no)).copy()
+            for list_no in range(index.nlist) if invlists.list_size(list_no)
+        ]).astype("int64")
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        return index.reconstruct_batch(ids), ids
+
+    inner = faiss.downcast_index(index.index)
+    vectors = inner.reconstruct_n(0, index.ntotal)
+    ids = faiss.vector_to_array(index.id_map).astype("int64")
+    return vectors, ids
+
+
+def write_index(index, path):
+    """
+    Write `index` to a temporary file next to `path` and rename it into place, so readers
+    (in any process) see either the previous or the new index, never a partial file.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        faiss.write_index(index, tmp_path)
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def parse_search_options(data):
+    """
+    The `ef_search` / `nprobe` options of a search request body, validated as positive integers.
+    Returns the keyword arguments for retrieve_for_prompt; raises ValueError.
+    """
+    options = {}
+    for name in ("ef_search", "nprobe"):
+        value = data.get(name)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, str)) or not str(value).strip().isdigit():
+            raise ValueError(f"'{name}' must be a positive integer")
+        value = int(value)
+        if value <= 0:
+            raise ValueError(f"'{name}' must be a positive integer")
+        options[name] = value
+    return options
+
+
+def search_parameters(index, ef_search=None, nprobe=None, selector=None):
+    """
+    Per-query search parameters for the given index: efSearch for HNSW, nprobe for IVF
+    (positive integers, see parse_search_options). Returns None when defaults apply.
+    """
+    index_type = index_type_of(index)
+    if index_type == "hnsw" and ef_search is not None:
+        params = faiss.SearchParametersHNSW(efSearch=int(ef_search))
+    elif index_type == "ivfpq" and nprobe is not None:
+        params = faiss.SearchParametersIVF(nprobe=int(nprobe))
+    elif selector is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+
+    if selector is not None:
+        params.sel = selector
+    return params
@@ -0,0 +1,252 @@
+import os
+import uuid
+import logging
+import threading
+import traceback
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import Table, Column, Integer, String, Text, DateTime, ForeignKey, select, insert, update
+from utils.db import engine, metadata, init_db
+from utils.cv_processing import load_cv_contents, embed_cv_contents, store_embeddings_batch
+
+logger = logging.getLogger(__name__)
+
+# Number of ingestion jobs processed concurrently by this process
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 2))
+
+# Job status: queued -> running -> done | failed
+# File status: pending -> extracted -> done | failed
+job_table = Table(
+    "ingest_job", metadata,
+    Column("id", String(32), primary_key=True),
+    Column("group_name", String(255), nullable=False),
+    Column("status", String(20), nullable=False, default="queued"),
+    Column("owner_pid", Integer, nullable=True),
+    Column("error", Text, nullable=True),
+    Column("created_at", DateTime, default=datetime.utcnow),
+    Column("updated_at", DateTime, default=datetime.utcnow, onupdate=datetime.utcnow),
+)
+
+job_file_table = Table(
+    "ingest_job_file", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("job_id", String(32), ForeignKey("ingest_job.id"), nullable=False, index=True),
+    Column("original_filename", String(255), nullable=False),
+    Column("stored_filename", String(255), nullable=False),
+    Column("filepath", String(255), nullable=False),
+    Column("content_hash", String(64), nullable=True),  # sha256 computed while the upload was received
+    Column("status", String(20), nullable=False, default="pending"),
+    Column("chunks", Integer, nullable=True),
+    Column("error", Text, nullable=True),
+    # "file" / "text" when the content cache already had this file's chunks and embeddings
+    Column("reused", String(10), nullable=True),
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+_on_file_failed = None
+_existing_files = None
+
+
+def start_ingest_workers(on_file_failed=None, existing_files=None):
+    """
+    Start this process's worker pool and pick up jobs left behind by a stopped process.
+    `on_file_failed(stored_filename)` is called for each file that could not be ingested.
+    `existing_files(stored_filenames)` returns those whose upload still exists; it is checked
+    right before a job stores its chunks, so CVs deleted while queued are not indexed.
+    """
+    global _executor, _on_file_failed, _existing_files
+    init_db()
+    with _executor_lock:
+        _on_file_failed = on_file_failed
+        _existing_files = existing_files
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+
+    for job_id in _requeue_stale_jobs():
+        _executor.submit(_run_job, job_id)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _requeue_stale_jobs():
+    """
+    Return queued jobs, and running jobs whose owner process is gone, so they can be resubmitted.
+    """
+    with engine.begin() as conn:
+        rows = conn.execute(
+            select(job_table.c.id, job_table.c.status, job_table.c.owner_pid)
+            .where(job_table.c.status.in_(["queued", "running"]))
+        ).all()
+        stale = []
+        for row in rows:
+            if row.status == "running" and row.owner_pid and _pid_alive(row.owner_pid):
+                continue
+            conn.execute(
+                update(job_table).where(job_table.c.id == row.id).values(status="queued", owner_pid=None)
+            )
+            stale.append(row.id)
+    return stale
+
+
+def enqueue_job(group, files):
+    """
+    Persist a job for already saved files and hand it to the worker pool.
+    `files` is a list of dicts with original_filename, stored_filename, filepath and
+    optionally content_hash (the file's sha256, so it is not read again to hash it).
+    Returns the job id.
+    """
+    if _executor is None:
+        start_ingest_workers()
+
+    job_id = uuid.uuid4().hex
+    with engine.begin() as conn:
+        conn.execute(insert(job_table).values(id=job_id, group_name=group, status="queued"))
+        conn.execute(insert(job_file_table), [
+            {
+                "job_id": job_id,
+                "original_filename": f["original_filename"],
+                "stored_filename": f["stored_filename"],
+                "filepath": f["filepath"],
+                "content_hash": f.get("content_hash"),
+                "status": "pending"
+            } for f in files
+        ])
+
+    _executor.submit(_run_job, job_id)
+    return job_id
+
+
+def get_job(job_id):
+    """
+    Return the job with per-file progress, or None if it does not exist.
+    """
+    init_db()
+    with engine.connect() as conn:
+        job = conn.execute(select(job_table).where(job_table.c.id == job_id)).first()
+        if job is None:
+            return None
+        files = conn.execute(
+            select(job_file_table).where(job_file_table.c.job_id == job_id).order_by(job_file_table.c.id)
+        ).all()
+
+    return {
+        "id": job.id,
+        "group": job.group_name,
+        "status": job.status,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+        "progress": {
+            "total": len(files),
+            "done": sum(1 for f in files if f.status == "done"),
+            "failed": sum(1 for f in files if f.status == "failed"),
+        },
+        "files": [
+            {
+                "original_filename": f.original_filename,
+                "stored_filename": f.stored_filename,
+                "status": f.status,
+                "chunks": f.chunks,
+                "reused": f.reused,
+                "error": f.error
+            } for f in files
+        ]
+    }
+
+
+def _claim_job(job_id):
+    with engine.begin() as conn:
+        result = conn.execute(
+            update(job_table)
+            .where(job_table.c.id == job_id, job_table.c.status == "queued")
+            .values(status="running", owner_pid=os.getpid())
+        )
+        if result.rowcount != 1:
+            return None
+        return conn.execute(select(job_table.c.group_name).where(job_table.c.id == job_id)).scalar()
+
+
+def _set_file(file_id, **values):
+    with engine.begin() as conn:
+        conn.execute(update(job_file_table).where(job_file_table.c.id == file_id).values(**values))
+
+
+def _set_job(job_id, **values):
+    with engine.begin() as conn:
+        conn.execute(update(job_table).where(job_table.c.id == job_id).values(**values))
+
+
+def _file_failed(file_row, error):
+    _set_file(file_row.id, status="failed", error=error)
+    if _on_file_failed:
+        try:
+            _on_file_failed(file_row.stored_filename)
+        except Exception:
+            logger.error("on_file_failed callback failed for %s: %s", file_row.stored_filename, traceback.format_exc())
+
+
+def _run_job(job_id):
+    group = _claim_job(job_id)
+    if group is None:
+        return  # already taken by another worker/process
+
+    try:
+        with engine.connect() as conn:
+            files = conn.execute(
+                select(job_file_table)
+                .where(job_file_table.c.job_id == job_id, job_file_table.c.status != "done")
+                .order_by(job_file_table.c.id)
+            ).all()
+
+        # 1. Extract all files (unless their content is cached) concurrently in the extraction
+        #    process pool, recording progress and errors per file
+        extracted = []
+        contents = load_cv_contents([(f.filepath, f.original_filename, f.content_hash) for f in files])
+        for f, content in zip(files, contents):
+            if isinstance(content, Exception):
+                logger.error("Error extracting %s", f.original_filename, exc_info=content)
+                _file_failed(f, str(content))
+                continue
+            _set_file(f.id, status="extracted", chunks=len(content["chunks"]), reused=content["reused"])
+            extracted.append((f, content))
+
+        # 2. One batched embed of the uncached contents + index append for the whole job
+        if extracted:
+            embed_cv_contents([content for _, content in extracted])
+            deleted = set()
+
+            def keep(stored_filenames):
+                existing = set(_existing_files(stored_filenames)) if _existing_files else set(stored_filenames)
+                deleted.update(set(stored_filenames) - existing)
+                return existing
+
+            store_embeddings_batch([
+                (f.stored_filename, content["chunks"], content["embeddings"]) for f, content in extracted
+            ], group, keep=keep)
+            for f, _ in extracted:
+                if f.stored_filename in deleted:
+                    _set_file(f.id, status="failed", error="CV was deleted before it was indexed")
+                else:
+                    _set_file(f.id, status="done")
+
+        _set_job(job_id, status="done")
+
+    except Exception as e:
+        logger.error("Ingestion job %s failed: %s", job_id, traceback.format_exc())
+        with engine.connect() as conn:
+            unfinished = conn.execute(
+                select(job_file_table)
+                .where(job_file_table.c.job_id == job_id, job_file_table.c.status.in_(["pending", "extracted"]))
+            ).all()
+        for f in unfinished:
+            _file_failed(f, str(e))
+        _set_job(job_id, status="failed", error=str(e))
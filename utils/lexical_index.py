@@ -0,0 +1,265 @@
+import os
+import re
+import math
+import heapq
+import threading
+from collections import Counter
+from sqlalchemy import Table, Column, Integer, BigInteger, String, Index, select, insert, update, delete, func, bindparam
+from utils.db import engine, metadata, init_db
+
+# BM25 parameters
+BM25_K1 = float(os.getenv("BM25_K1", 1.2))
+BM25_B = float(os.getenv("BM25_B", 0.75))
+# Query terms scored per group, the highest-IDF ones. A JD has hundreds of distinct terms and the
+# common ones, which contribute least to the score, have the longest posting lists.
+BM25_MAX_QUERY_TERMS = int(os.getenv("BM25_MAX_QUERY_TERMS", 32))
+
+# Inverted index: term frequency of each term in each chunk, per group.
+# `faiss_id` identifies the chunk within its group, as in the chunk table.
+term_posting_table = Table(
+    "term_posting", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("group_name", String(255), nullable=False),
+    Column("term", String(64), nullable=False),
+    Column("faiss_id", BigInteger, nullable=False),
+    Column("tf", Integer, nullable=False),
+    Index("ix_term_posting_group_term", "group_name", "term"),
+    Index("ix_term_posting_group_faiss_id", "group_name", "faiss_id"),
+)
+
+# Token count of each indexed chunk, for BM25 length normalization
+lexical_doc_table = Table(
+    "lexical_doc", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("group_name", String(255), nullable=False),
+    Column("faiss_id", BigInteger, nullable=False),
+    Column("length", Integer, nullable=False),
+    Index("ix_lexical_doc_group_faiss_id", "group_name", "faiss_id", unique=True),
+)
+
+# Document frequency of each term per group, kept up to date with the postings, so picking the
+# query terms to score is a keyed lookup rather than a count over their postings
+term_stats_table = Table(
+    "term_stats", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("group_name", String(255), nullable=False),
+    Column("term", String(64), nullable=False),
+    Column("df", Integer, nullable=False),
+    Index("ix_term_stats_group_term", "group_name", "term", unique=True),
+)
+
+# Max bound parameters per IN list, below SQLite's limit
+_IN_BATCH = 500
+
+_TOKEN_RE = re.compile(r"[a-z0-9][a-z0-9+#.]*")
+_STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it of on or that the this to was were will with
+we you your our i my me he she they them their his her its not but if so than then there these those
+""".split())
+
+# Groups whose inverted index is known to be built, in this process
+_indexed_groups = set()
+_indexed_lock = threading.Lock()
+
+
+def _group_key(group):
+    return group.replace(" ", "_").lower()
+
+
+def tokenize(text):
+    """
+    Lowercased terms of `text`, keeping skill names like "c++", "c#" and "node.js" whole.
+    """
+    terms = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        token = token.rstrip(".")
+        if token and token not in _STOPWORDS:
+            terms.append(token[:64])
+    return terms
+
+
+def _batches(items, size=_IN_BATCH):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _get_doc_freq(key, terms, conn):
+    doc_freq = {}
+    for batch in _batches(terms):
+        doc_freq.update(conn.execute(
+            select(term_stats_table.c.term, term_stats_table.c.df)
+            .where(term_stats_table.c.group_name == key, term_stats_table.c.term.in_(batch))
+        ).all())
+    return doc_freq
+
+
+def _change_doc_freq(key, deltas, conn):
+    """
+    Add `deltas` ({term: change}) to the group's document frequencies.
+    """
+    existing = _get_doc_freq(key, deltas, conn)
+    if existing:
+        conn.execute(
+            update(term_stats_table)
+            .where(term_stats_table.c.group_name == key, term_stats_table.c.term == bindparam("t"))
+            .values(df=term_stats_table.c.df + bindparam("n")),
+            [{"t": term, "n": deltas[term]} for term in existing]
+        )
+    new = [{"group_name": key, "term": term, "df": n} for term, n in deltas.items() if term not in existing and n > 0]
+    if new:
+        conn.execute(insert(term_stats_table), new)
+    if any(n < 0 for n in deltas.values()):
+        conn.execute(delete(term_stats_table).where(term_stats_table.c.group_name == key, term_stats_table.c.df <= 0))
+
+
+def add_chunks(group, chunks, conn):
+    """
+    Index chunk dicts (with `id` and `text`) of a group, inside the caller's transaction.
+    """
+    key = _group_key(group)
+    postings, docs = [], []
+    doc_freq = Counter()
+    for chunk in chunks:
+        terms = tokenize(chunk["text"])
+        docs.append({"group_name": key, "faiss_id": chunk["id"], "length": len(terms)})
+        term_freq = Counter(terms)
+        doc_freq.update(term_freq.keys())
+        postings.extend(
+            {"group_name": key, "term": term, "faiss_id": chunk["id"], "tf": tf}
+            for term, tf in term_freq.items()
+        )
+    if docs:
+        conn.execute(insert(lexical_doc_table), docs)
+    if postings:
+        conn.execute(insert(term_posting_table), postings)
+        _change_doc_freq(key, doc_freq, conn)
+
+
+def delete_chunks(group, faiss_ids, conn):
+    """
+    Remove chunks from the group's inverted index. `faiss_ids` may be a list or a select of ids.
+    """
+    key = _group_key(group)
+    removed = conn.execute(
+        select(term_posting_table.c.term, func.count())
+        .where(term_posting_table.c.group_name == key, term_posting_table.c.faiss_id.in_(faiss_ids))
+        .group_by(term_posting_table.c.term)
+    ).all()
+    if removed:
+        _change_doc_freq(key, {term: -n for term, n in removed}, conn)
+    conn.execute(delete(term_posting_table).where(
+        term_posting_table.c.group_name == key, term_posting_table.c.faiss_id.in_(faiss_ids)
+    ))
+    conn.execute(delete(lexical_doc_table).where(
+        lexical_doc_table.c.group_name == key, lexical_doc_table.c.faiss_id.in_(faiss_ids)
+    ))
+
+
+def delete_group(group, conn):
+    key = _group_key(group)
+    conn.execute(delete(term_posting_table).where(term_posting_table.c.group_name == key))
+    conn.execute(delete(lexical_doc_table).where(lexical_doc_table.c.group_name == key))
+    conn.execute(delete(term_stats_table).where(term_stats_table.c.group_name == key))
+    _indexed_groups.discard(key)
+
+
+def delete_all(conn):
+    conn.execute(delete(term_posting_table))
+    conn.execute(delete(lexical_doc_table))
+    conn.execute(delete(term_stats_table))
+    _indexed_groups.clear()
+
+
+def ensure_indexed(group):
+    """
+    (Re)build the inverted index of a group if it does not cover all of the group's chunks,
+    e.g. chunks stored before lexical indexing existed, and its document frequencies if they
+    are missing (indexes built before they were kept). Checked once per group and process.
+    """
+    from utils.chunk_store import chunk_table
+
+    key = _group_key(group)
+    if key in _indexed_groups:
+        return
+
+    init_db()
+    with _indexed_lock:
+        if key in _indexed_groups:
+            return
+        with engine.begin() as conn:
+            indexed = conn.execute(
+                select(func.count()).select_from(lexical_doc_table).where(lexical_doc_table.c.group_name == key)
+            ).scalar()
+            stored = conn.execute(
+                select(func.count()).select_from(chunk_table).where(chunk_table.c.group_name == key)
+            ).scalar()
+            if indexed != stored:
+                rows = conn.execute(
+                    select(chunk_table.c.faiss_id, chunk_table.c.text).where(chunk_table.c.group_name == key)
+                ).all()
+                conn.execute(delete(term_posting_table).where(term_posting_table.c.group_name == key))
+                conn.execute(delete(lexical_doc_table).where(lexical_doc_table.c.group_name == key))
+                conn.execute(delete(term_stats_table).where(term_stats_table.c.group_name == key))
+                add_chunks(group, [{"id": row.faiss_id, "text": row.text} for row in rows], conn)
+                print(f"🔤 Built BM25 index for group '{group}' ({len(rows)} chunks)")
+            elif stored and not conn.execute(
+                select(term_stats_table.c.id).where(term_stats_table.c.group_name == key).limit(1)
+            ).first():
+                conn.execute(insert(term_stats_table).from_select(
+                    ["group_name", "term", "df"],
+                    select(term_posting_table.c.group_name, term_posting_table.c.term, func.count())
+                    .where(term_posting_table.c.group_name == key)
+                    .group_by(term_posting_table.c.group_name, term_posting_table.c.term)
+                ))
+        _indexed_groups.add(key)
+
+
+def search(groups, query, k):
+    """
+    BM25 search of `query` over the inverted indexes of `groups`.
+    Returns the best k (group, faiss_id, score) hits, best first. IDF and average chunk
+    length are per group, like the groups' vector indexes. Only the BM25_MAX_QUERY_TERMS
+    highest-IDF terms of the query are scored.
+    """
+    terms = set(tokenize(query))
+    if not terms or k <= 0:
+        return []
+
+    hits = []
+    for group in groups:
+        ensure_indexed(group)
+        key = _group_key(group)
+        with engine.connect() as conn:
+            n_docs, avg_length = conn.execute(
+                select(func.count(), func.avg(lexical_doc_table.c.length))
+                .where(lexical_doc_table.c.group_name == key)
+            ).one()
+            if not n_docs:
+                continue
+            avg_length = float(avg_length) or 1.0
+
+            doc_freq = _get_doc_freq(key, terms, conn)
+            if not doc_freq:
+                continue
+            idf = {term: math.log(1 + (n_docs - df + 0.5) / (df + 0.5)) for term, df in doc_freq.items()}
+            if len(idf) > BM25_MAX_QUERY_TERMS:
+                idf = {term: idf[term] for term in heapq.nlargest(BM25_MAX_QUERY_TERMS, idf, key=idf.get)}
+
+            postings = conn.execute(
+                select(term_posting_table.c.faiss_id, term_posting_table.c.term, term_posting_table.c.tf,
+                       lexical_doc_table.c.length)
+                .join(lexical_doc_table, (lexical_doc_table.c.group_name == term_posting_table.c.group_name)
+                      & (lexical_doc_table.c.faiss_id == term_posting_table.c.faiss_id))
+                .where(term_posting_table.c.group_name == key, term_posting_table.c.term.in_(idf))
+            ).all()
+
+        scores = Counter()
+        for faiss_id, term, tf, length in postings:
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+            scores[faiss_id] += idf[term] * tf * (BM25_K1 + 1) / (tf + norm)
+
+        hits.extend((group, faiss_id, score) for faiss_id, score in scores.most_common(k))
+
+    hits.sort(key=lambda hit: hit[2], reverse=True)
+    return hits[:k]
@@ -1,18 +1,25 @@
 # llm.py
 
 import os
+import re
 import json
 import logging
-import asyncio
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from flask.cli import load_dotenv
-import openai
 
 load_dotenv()
 
-# Set OpenAI key
-openai_key = os.getenv("OPENAI_API_KEY")
-openai_client = openai.AsyncOpenAI(api_key=openai_key) # This is used for openai.ChatCompletion.* calls
+# Imported after load_dotenv so the client picks up OPENAI_API_KEY / LLM_* settings from .env
+from utils.llm_client import (
+    LLM_MAX_CONCURRENCY, chat_completion, async_chat_completion, stream_chat_completion, async_stream_chat_completion
+)
+from utils.tokens import count_tokens, truncate_to_tokens
+
+# Max tokens of resume context put into a prompt, shared across candidates by score
+PROMPT_CONTEXT_TOKENS = int(os.getenv("PROMPT_CONTEXT_TOKENS", 3000))
+
+SYSTEM_PROMPT = "You are an HR assistant that answers questions about candidate resumes."
 
 # --- Normalize response from OpenAI ---
 def normalize_llm_response(raw_response: dict) -> dict:
@@ -38,50 +45,255 @@ def normalize_llm_response(raw_response: dict) -> dict:
             "raw": raw_response
         }
 
-# --- Synchronous wrapper for OpenAI async call ---
+def _messages(prompt: str) -> list[dict]:
+    return [
+        {
+            "role": "system",
+            "content": SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": prompt
+        }
+    ]
+
+# --- OpenAI call from sync code (Flask routes, worker threads) ---
 def query_with_openai_sdk(prompt: str) -> dict:
     """
     Calls OpenAI chat model and returns parsed JSON response.
-    Uses asyncio.run to bridge async call from Flask sync route.
-    """
-    async def _call():
-        try:
-            response = await openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an HR assistant that answers questions about candidate resumes."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                temperature= 0,
-                response_format={"type": "json_object"}
-            )
-            return json.loads(response.choices[0].message.content.strip())
-
-        except Exception as e:
-            logging.error("Error calling OpenAI LLM", exc_info=True)
-            return {"error": str(e)}
-
-    return asyncio.run(_call())
+    Uses the shared pooled client, with retries on 429/5xx and bounded concurrency.
+    """
+    try:
+        response = chat_completion(
+            _messages(prompt),
+            temperature= 0,
+            response_format={"type": "json_object"}
+        )
+        return json.loads(response.choices[0].message.content.strip())
+
+    except Exception as e:
+        logging.error("Error calling OpenAI LLM", exc_info=True)
+        return {"error": str(e)}
+
+# --- Several OpenAI calls at once (batch screening) ---
+def query_many_with_openai_sdk(calls: list) -> list:
+    """
+    Run several LLM calls concurrently and return their results in order. Each item of
+    `calls` is a zero-argument callable (e.g. a cached query_with_openai_sdk); at most
+    LLM_MAX_CONCURRENCY requests are in flight, bounded by the shared client semaphore.
+    """
+    if not calls:
+        return []
+    with ThreadPoolExecutor(max_workers=min(len(calls), LLM_MAX_CONCURRENCY), thread_name_prefix="llm") as threads:
+        return list(threads.map(lambda call: call(), calls))
+
+# --- OpenAI call from async code (FastAPI routes) ---
+async def async_query_with_openai_sdk(prompt: str) -> dict:
+    """
+    Async variant of query_with_openai_sdk, does not block the event loop.
+    """
+    try:
+        response = await async_chat_completion(
+            _messages(prompt),
+            temperature= 0,
+            response_format={"type": "json_object"}
+        )
+        return json.loads(response.choices[0].message.content.strip())
+
+    except Exception as e:
+        logging.error("Error calling OpenAI LLM", exc_info=True)
+        return {"error": str(e)}
+
+# --- Streaming OpenAI call ---
+def stream_query_with_openai_sdk(prompt: str):
+    """
+    Streams the raw JSON answer of the chat model, yielding text deltas.
+    Errors are raised to the caller, who has already started its response.
+    """
+    yield from stream_chat_completion(
+        _messages(prompt),
+        temperature= 0,
+        response_format={"type": "json_object"}
+    )
+
+async def async_stream_query_with_openai_sdk(prompt: str):
+    """
+    Async variant of stream_query_with_openai_sdk.
+    """
+    async for delta in async_stream_chat_completion(
+        _messages(prompt),
+        temperature= 0,
+        response_format={"type": "json_object"}
+    ):
+        yield delta
+
+_SUMMARY_RE = re.compile(r'"summary"\s*:\s*"((?:[^"\\]|\\.)*)"')
+_CANDIDATES_RE = re.compile(r'"candidate_details"\s*:\s*\[')
+
+class CandidateStreamParser:
+    """
+    Incrementally parses a streamed answer, picking up the "summary" as soon as it is
+    complete and each object of "candidate_details" as soon as its closing brace arrives.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.summary = None
+        self._pos = None  # scan position inside the candidate_details array
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._object_start = None
+        self._array_done = False
+
+    def feed(self, text: str) -> list[dict]:
+        """
+        Add a chunk of the stream, returns the candidate objects completed by it.
+        """
+        self.buffer += text
+        candidates = []
+
+        if self.summary is None:
+            match = _SUMMARY_RE.search(self.buffer)
+            if match:
+                self.summary = json.loads(f'"{match.group(1)}"')
+
+        if self._pos is None:
+            match = _CANDIDATES_RE.search(self.buffer)
+            if not match:
+                return candidates
+            self._pos = match.end()
+
+        while self._pos < len(self.buffer) and not self._array_done:
+            ch = self.buffer[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                if self._depth == 0:
+                    self._object_start = self._pos
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    candidates.append(json.loads(self.buffer[self._object_start:self._pos + 1]))
+            elif ch == "]" and self._depth == 0:
+                self._array_done = True
+            self._pos += 1
+
+        return candidates
+
+    def result(self) -> dict:
+        """
+        Parse the complete answer once the stream has ended.
+        """
+        return json.loads(self.buffer.strip())
 
 # --- Build context-rich prompt ---
-def build_prompt(question: str, retrieved_chunks: list[dict]) -> str:
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def _fill(sentences, budget):
+    """
+    Take whole sentences while they fit in `budget` tokens. If not even the first one
+    fits, it is cut at the token boundary instead, so no candidate ends up empty.
+    Returns (text, tokens used).
+    """
+    taken, used = [], 0
+    for sentence in sentences:
+        tokens = count_tokens(sentence + " ")
+        if used + tokens > budget:
+            break
+        taken.append(sentence)
+        used += tokens
+
+    if not taken and sentences:
+        text = truncate_to_tokens(sentences[0], budget)
+        return text, count_tokens(text) if text else 0
+    return " ".join(taken), used
+
+
+def build_context(retrieved_chunks: list[dict], token_budget: int = PROMPT_CONTEXT_TOKENS) -> tuple[str, dict]:
+    """
+    Assemble the candidate context blocks within `token_budget` tokens. Candidates are
+    taken best first and each gets a share of the remaining budget proportional to its
+    score, so budget a candidate does not need passes on to the next ones. Texts are
+    trimmed at sentence boundaries.
+    Returns (context, stats) with the tokens used and how many candidates were trimmed.
+    """
     grouped = defaultdict(list)
+    weights = {}
     for chunk in retrieved_chunks:
-        grouped[chunk["source_file"]].append(chunk["text"])
+        source_file = chunk["source_file"]
+        grouped[source_file].append(chunk["text"])
+        score = chunk.get("candidate_score", chunk.get("score"))
+        weight = max(float(score), 0.0) if score is not None else 1.0
+        weights[source_file] = max(weights.get(source_file, 0.0), weight)
+
+    if not any(weights.values()):
+        weights = dict.fromkeys(weights, 1.0)
+    order = sorted(grouped, key=lambda f: weights[f], reverse=True)
+    remaining_weight = sum(weights.values())
 
     context_blocks = []
-    for source_file, chunks in grouped.items():
-        combined_text = "\n".join(chunks)
-        context_blocks.append(f"Candidate from file: {source_file}\n{combined_text}")
+    remaining = token_budget
+    trimmed = 0
+    for source_file in order:
+        weight = weights[source_file]
+        share = int(remaining * weight / remaining_weight) if remaining_weight > 0 else 0
+        remaining_weight -= weight
+
+        header = f"Candidate from file: {source_file}\n"
+        header_tokens = count_tokens(header)
+        if share <= header_tokens:
+            trimmed += 1
+            continue
+
+        sentences = [s for text in grouped[source_file] for s in _SENTENCE_SPLIT_RE.split(text) if s.strip()]
+        text, used = _fill(sentences, share - header_tokens)
+        if len(text) < len(" ".join(sentences)):
+            trimmed += 1
+        if not text:
+            continue
+        context_blocks.append(header + text)
+        remaining -= header_tokens + used
+
+    context = "\n\n".join(context_blocks)
+    return context, {
+        "context_tokens": token_budget - remaining,
+        "candidates": len(context_blocks),
+        "trimmed_candidates": trimmed,
+    }
+
+
+def build_prompt_with_stats(question: str, retrieved_chunks: list[dict],
+                            token_budget: int = PROMPT_CONTEXT_TOKENS) -> tuple[str, dict]:
+    """
+    Build the prompt and return it with its token usage: the context stats of
+    build_context plus `prompt_tokens` for the whole prompt.
+    """
+    full_context, stats = build_context(retrieved_chunks, token_budget)
+    prompt = _prompt_template(question, full_context)
+    stats["prompt_tokens"] = count_tokens(prompt)
+    return prompt, stats
+
+
+def build_prompt(question: str, retrieved_chunks: list[dict], token_budget: int = PROMPT_CONTEXT_TOKENS) -> str:
+    prompt, stats = build_prompt_with_stats(question, retrieved_chunks, token_budget)
+    logging.info(
+        "Prompt: %(prompt_tokens)d tokens, context %(context_tokens)d tokens over %(candidates)d candidates "
+        "(%(trimmed_candidates)d trimmed)", stats
+    )
+    return prompt
 
-    full_context = "\n\n".join(context_blocks)
 
+def _prompt_template(question: str, full_context: str) -> str:
     return f"""You are an HR assistant that answers questions based only on resume (CV) information.
 
 Context:
@@ -0,0 +1,109 @@
+import os
+import asyncio
+import threading
+import weakref
+import httpx
+import openai
+
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o")
+# Max number of in-flight LLM requests per process (sync and async each)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+# Retries with exponential backoff on 408/409/429/5xx and connection errors (done by the SDK)
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 3))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 120))
+
+_limits = httpx.Limits(
+    max_connections=LLM_MAX_CONCURRENCY,
+    max_keepalive_connections=LLM_MAX_CONCURRENCY,
+    keepalive_expiry=60
+)
+
+_sync_client = None
+_sync_lock = threading.Lock()
+_sync_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+
+# An async httpx pool is bound to the event loop it was created on, so keep one client per loop
+_async_clients = weakref.WeakKeyDictionary()  # loop -> (client, semaphore)
+
+
+def get_client():
+    """
+    Long-lived sync OpenAI client with a keep-alive connection pool, shared by all threads.
+    """
+    global _sync_client
+    if _sync_client is None:
+        with _sync_lock:
+            if _sync_client is None:
+                _sync_client = openai.OpenAI(
+                    api_key=os.getenv("OPENAI_API_KEY"),
+                    max_retries=LLM_MAX_RETRIES,
+                    timeout=LLM_TIMEOUT,
+                    http_client=httpx.Client(limits=_limits, timeout=LLM_TIMEOUT)
+                )
+    return _sync_client
+
+
+def get_async_client():
+    """
+    Async OpenAI client (and concurrency semaphore) for the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    entry = _async_clients.get(loop)
+    if entry is None:
+        client = openai.AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            max_retries=LLM_MAX_RETRIES,
+            timeout=LLM_TIMEOUT,
+            http_client=httpx.AsyncClient(limits=_limits, timeout=LLM_TIMEOUT)
+        )
+        entry = (client, asyncio.Semaphore(LLM_MAX_CONCURRENCY))
+        _async_clients[loop] = entry
+    return entry
+
+
+def chat_completion(messages, model=LLM_MODEL, **kwargs):
+    """
+    Blocking chat completion, for the Flask routes and worker threads.
+    """
+    with _sync_slots:
+        return get_client().chat.completions.create(model=model, messages=messages, **kwargs)
+
+
+def stream_chat_completion(messages, model=LLM_MODEL, **kwargs):
+    """
+    Blocking streaming chat completion. Yields content deltas as they arrive and
+    holds a concurrency slot until the stream is exhausted or closed.
+    """
+    with _sync_slots:
+        stream = get_client().chat.completions.create(model=model, messages=messages, stream=True, **kwargs)
+        try:
+            for event in stream:
+                if event.choices and event.choices[0].delta.content:
+                    yield event.choices[0].delta.content
+        finally:
+            stream.close()
+
+
+async def async_chat_completion(messages, model=LLM_MODEL, **kwargs):
+    """
+    Non-blocking chat completion, for the FastAPI routes.
+    """
+    client, slots = get_async_client()
+    async with slots:
+        return await client.chat.completions.create(model=model, messages=messages, **kwargs)
+
+
+async def async_stream_chat_completion(messages, model=LLM_MODEL, **kwargs):
+    """
+    Non-blocking streaming chat completion. Yields content deltas as they arrive and
+    holds a concurrency slot until the stream is exhausted or closed.
+    """
+    client, slots = get_async_client()
+    async with slots:
+        stream = await client.chat.completions.create(model=model, messages=messages, stream=True, **kwargs)
+        try:
+            async for event in stream:
+                if event.choices and event.choices[0].delta.content:
+                    yield event.choices[0].delta.content
+        finally:
+            await stream.close()
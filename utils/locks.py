@@ -0,0 +1,65 @@
+import os
+import fcntl
+import threading
+
+LOCK_DIR = os.path.join("vector_store", ".locks")
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+class FileLock:
+    """
+    Re-entrant lock shared by the threads of this process (RLock) and by other worker
+    processes (fcntl lock file). The file lock is held for the outermost `with` block only.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def acquire(self):
+        self._lock.acquire()
+        try:
+            if self._depth == 0:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                lock_file = open(self.path, "a")
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                except BaseException:
+                    lock_file.close()
+                    raise
+                self._file = lock_file
+            self._depth += 1
+        except BaseException:
+            self._lock.release()
+            raise
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            lock_file, self._file = self._file, None
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def group_lock(group):
+    """
+    Lock serializing read-modify-write of a group's index files across threads and worker processes.
+    """
+    key = group.replace(" ", "_").lower()
+    with _locks_lock:
+        lock = _locks.get(key)
+        if lock is None:
+            lock = _locks[key] = FileLock(os.path.join(LOCK_DIR, f"{key}.lock"))
+    return lock
@@ -0,0 +1,141 @@
+import os
+import re
+import copy
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", 1024))
+LLM_ANSWER_CACHE_SIZE = int(os.getenv("LLM_ANSWER_CACHE_SIZE", 256))
+LLM_ANSWER_CACHE_TTL = float(os.getenv("LLM_ANSWER_CACHE_TTL", 3600))
+
+
+class TTLLRUCache:
+    """
+    Thread-safe LRU cache with an optional per-entry time to live (in seconds).
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Level 1: normalized (expanded) query -> embedding vector
+query_embedding_cache = TTLLRUCache(QUERY_EMBEDDING_CACHE_SIZE)
+# Level 2: (prompt hash, index version) -> parsed LLM JSON answer
+llm_answer_cache = TTLLRUCache(LLM_ANSWER_CACHE_SIZE, ttl=LLM_ANSWER_CACHE_TTL)
+
+
+def normalize_query(query):
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+def get_query_embedding(query, encode):
+    """
+    Return the embedding of `query`, calling `encode(query)` only on a cache miss.
+    """
+    key = normalize_query(query)
+    embedding = query_embedding_cache.get(key)
+    if embedding is None:
+        embedding = encode(query)
+        query_embedding_cache.set(key, embedding)
+    return embedding
+
+
+def get_query_embeddings(queries, encode):
+    """
+    Return the (len(queries), d) embedding matrix of `queries`, calling `encode(texts)`
+    once for all cache misses.
+    """
+    keys = [normalize_query(query) for query in queries]
+    embeddings = [query_embedding_cache.get(key) for key in keys]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        encoded = encode([queries[i] for i in missing])
+        for i, row in zip(missing, encoded):
+            embeddings[i] = row[None, :]
+            query_embedding_cache.set(keys[i], embeddings[i])
+    return np.vstack(embeddings)
+
+
+def _answer_key(prompt, index_version):
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest(), index_version
+
+
+def peek_llm_answer(prompt, index_version):
+    """
+    Return a copy of the cached answer for `prompt` against the given index version, or None.
+    """
+    answer = llm_answer_cache.get(_answer_key(prompt, index_version))
+    return copy.deepcopy(answer) if answer is not None else None
+
+
+def store_llm_answer(prompt, index_version, answer):
+    """
+    Cache an LLM answer. Error answers are not cached.
+    """
+    if isinstance(answer, dict) and "error" not in answer:
+        llm_answer_cache.set(_answer_key(prompt, index_version), copy.deepcopy(answer))
+
+
+def get_llm_answer(prompt, index_version, call):
+    """
+    Return the cached LLM answer for `prompt` against the given index version, or call
+    `call()` and cache its result. Since the version changes whenever CVs are added to or
+    deleted from the searched groups, stale answers are never served.
+    A copy is returned, so callers may enrich it in place.
+    """
+    answer = peek_llm_answer(prompt, index_version)
+    if answer is None:
+        answer = call()
+        store_llm_answer(prompt, index_version, answer)
+    return answer
+
+
+async def async_get_llm_answer(prompt, index_version, call):
+    """
+    get_llm_answer for async code: `call()` returns an awaitable of the answer.
+    """
+    answer = peek_llm_answer(prompt, index_version)
+    if answer is None:
+        answer = await call()
+        store_llm_answer(prompt, index_version, answer)
+    return answer
+
+
+def clear_query_caches():
+    query_embedding_cache.clear()
+    llm_answer_cache.clear()
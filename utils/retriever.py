@@ -1,34 +1,50 @@
 import os
-import json
+import heapq
 import numpy as np
-import faiss
-from sentence_transformers import SentenceTransformer
-
-model = SentenceTransformer("all-MiniLM-L6-v2")
+from utils.index_cache import index_cache, cache_key_for_group
+from utils.cv_processing import get_index_path, get_legacy_metadata_path, group_lock, migrate_group, read_group_index
+from utils import chunk_store, lexical_index
+from utils.query_cache import get_query_embeddings
+from utils.embeddings import encode
+from utils.global_index import GLOBAL_INDEX_ENABLED, load_global_index, group_selector, split_global_id
+from utils.index_factory import is_cosine_index, search_parameters
 
 VECTOR_STORE_DIR = "vector_store"
 
-def get_paths_for_group(group):
-    safe_group = group.replace(" ", "_").lower()
-    index_path = os.path.join(VECTOR_STORE_DIR, f"{safe_group}_faiss_index.index")
-    metadata_path = os.path.join(VECTOR_STORE_DIR, f"{safe_group}_chunk_metadata.json")
-    return index_path, metadata_path
-
-def load_index_and_metadata(group):
-    index_path, metadata_path = get_paths_for_group(group)
-
-    if not os.path.exists(index_path) or not os.path.exists(metadata_path):
-        raise FileNotFoundError(f"No FAISS index or metadata found for group '{group}'")
-
-    index = faiss.read_index(index_path)
-    with open(metadata_path, "r", encoding="utf-8") as f:
-        metadata = json.load(f)
-
-    return index, metadata
+# "candidate": top distinct CVs with their best chunks, "chunk": top chunks as ranked
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "candidate").lower()
+# How a CV's chunk scores combine into its candidate score: "max", "sum" or "rrf"
+CANDIDATE_AGGREGATION = os.getenv("CANDIDATE_AGGREGATION", "max").lower()
+# Best chunks kept per candidate
+CANDIDATE_CHUNKS = int(os.getenv("CANDIDATE_CHUNKS", 2))
+# Chunks fetched per requested candidate, so that enough distinct CVs are found
+CANDIDATE_OVERFETCH = int(os.getenv("CANDIDATE_OVERFETCH", 4))
+RRF_K = 60
+# Fuse BM25 (over the per-group inverted index) with vector search
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() in ("1", "true", "yes")
 
+def load_index(group):
+    """
+    Return the FAISS index for a group, served from the process-wide index cache and only
+    re-read when the file on disk changes. The returned index is shared, callers must not mutate it.
+    Each read is checked against the chunk table (see read_group_index). Groups still on the
+    legacy JSON metadata layout or on L2 scoring are migrated on first access.
+    """
+    index_path = get_index_path(group)
 
+    if os.path.exists(get_legacy_metadata_path(group)):
+        with group_lock(group):
+            migrate_group(group)
 
+    if not os.path.exists(index_path):
+        raise FileNotFoundError(f"No FAISS index found for group '{group}'")
 
+    index = index_cache.get(cache_key_for_group(group), (index_path,), lambda: read_group_index(group))
+    if not is_cosine_index(index):
+        with group_lock(group):
+            migrate_group(group)
+        index = index_cache.get(cache_key_for_group(group), (index_path,), lambda: read_group_index(group))
+    return index
 
 def expand_query_with_keywords(query):
     keyword_map = {
@@ -61,8 +77,8 @@ def expand_query_with_keywords(query):
         if key in query_lower:
             matched_keywords.extend(terms)
 
-    # Remove duplicates and avoid adding terms already in query
-    unique_terms = [term for term in set(matched_keywords) if term not in query_lower]
+    # Remove duplicates (keeping a stable order) and avoid adding terms already in query
+    unique_terms = [term for term in dict.fromkeys(matched_keywords) if term not in query_lower]
 
     # Combine into a single expanded query string
     expanded_query = query.strip() + " " + " ".join(unique_terms) if unique_terms else query.strip()
@@ -91,45 +107,251 @@ def retrieve_similar_chunks(query: str, k: int = 5, group: str = "general"):
 
 def get_all_groups_with_indexes():
     """
-    Scan the vector_store directory to get all groups that have both FAISS index and metadata files.
+    Scan the vector_store directory to get all groups that have a FAISS index file.
     """
     groups = []
     for filename in os.listdir(VECTOR_STORE_DIR):
         if filename.endswith("_faiss_index.index"):
-            group = filename.replace("_faiss_index.index", "")
-            index_path, metadata_path = get_paths_for_group(group)
-            if os.path.exists(index_path) and os.path.exists(metadata_path):
-                groups.append(group)
+            groups.append(filename.replace("_faiss_index.index", ""))
     return groups
 
 
-def retrieve_similar_chunks(query: str, k: int = 5, group: str = None):
+def get_index_version(groups=None):
     """
-    Search FAISS index(es). If group is provided, search only in that group.
-    If group is None, search all available groups and merge results.
+    Version of the index(es) a search runs against: the mtime and size of each group's
+    index file. It changes whenever CVs are added to or deleted from any of the groups.
+    `groups` is a group name, a list of names, or None for all groups.
     """
-    query_embedding = model.encode([query])
-    query_vector = np.array(query_embedding).astype("float32")
+    if groups is None:
+        groups = get_all_groups_with_indexes()
+    elif isinstance(groups, str):
+        groups = [groups]
+
+    version = []
+    for grp in sorted(cache_key_for_group(g) for g in groups):
+        try:
+            st = os.stat(get_index_path(grp))
+            version.append((grp, st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            version.append((grp, None, None))
+    return tuple(version)
+
+
+def encode_queries(queries):
+    """
+    Embed several queries as a (n, d) float32 matrix, encoding all cache misses in one batch.
+    Queries only go through the in-memory query cache, never the persistent embedding store.
+    """
+    return get_query_embeddings(queries, encode)
+
+
+def _chunk_hits(hits_per_query):
+    """
+    Resolve (group, faiss_id, fields) hits of several queries to chunk dicts, updated with
+    `fields` (score etc.), with a single keyed lookup per group. Returns one result list per
+    query, in hit order.
+    """
+    faiss_ids_by_group = {}
+    for hits in hits_per_query:
+        for grp, faiss_id, _ in hits:
+            faiss_ids_by_group.setdefault(grp, set()).add(faiss_id)
+    chunks_by_group = {
+        grp: chunk_store.get_chunks_by_faiss_ids(grp, list(faiss_ids))
+        for grp, faiss_ids in faiss_ids_by_group.items()
+    }
+
+    results_per_query = []
+    for hits in hits_per_query:
+        results = []
+        for grp, faiss_id, fields in hits:
+            chunk = chunks_by_group[grp].get(faiss_id)
+            if chunk:
+                # Copy, the same chunk may be a hit of several queries
+                results.append(dict(chunk, group=grp, **fields))
+        results_per_query.append(results)
+    return results_per_query
+
+
+def _target_groups(group=None, groups=None):
+    if group:
+        return [group]
+    return groups if groups is not None else get_all_groups_with_indexes()
+
+
+def _global_vector_hits(query_vectors, k, groups=None, ef_search=None, nprobe=None):
+    """
+    One ANN query over the global index for all query rows, optionally restricted to the
+    id ranges of `groups`. `ef_search` / `nprobe` are passed on like for group indexes; the
+    global index is exact (flat), so they only take effect if it is ever built as HNSW / IVF.
+    """
+    index = load_global_index()
+    if index is None:
+        return [[] for _ in range(len(query_vectors))]
+
+    params = search_parameters(index, ef_search, nprobe, selector=group_selector(groups) if groups else None)
+    D, I = index.search(query_vectors, k, params=params)
+
+    hits_per_query = []
+    for row_distances, row_ids in zip(D, I):
+        hits = []
+        for similarity, global_id in zip(row_distances, row_ids):
+            if global_id >= 0:
+                grp, faiss_id = split_global_id(global_id)
+                hits.append((grp, faiss_id, float(similarity)))
+        hits_per_query.append(hits)
+    return hits_per_query
 
-    all_results = []
 
-    target_groups = [group] if group else get_all_groups_with_indexes()
+def _vector_hits(query_vectors, k, group=None, groups=None, ef_search=None, nprobe=None):
+    """
+    Search all query rows at once, a single multi-vector `index.search` per index.
+    Returns the best k (group, faiss_id, similarity) hits for each row, best first.
+    """
+    if not group and GLOBAL_INDEX_ENABLED:
+        return _global_vector_hits(query_vectors, k, groups, ef_search, nprobe)
 
-    for grp in target_groups:
+    hits_per_query = [[] for _ in range(len(query_vectors))]
+    for grp in _target_groups(group, groups):
         try:
-            index, metadata_list = load_index_and_metadata(grp)
-            D, I = index.search(query_vector, k)
-
-            for idx_pos, idx in enumerate(I[0]):
-                if idx < len(metadata_list):
-                    chunk = metadata_list[idx]
-                    chunk["score"] = round(float(D[0][idx_pos]), 2)
-                    chunk["group"] = grp
-                    all_results.append(chunk)
+            index = load_index(grp)
         except FileNotFoundError:
             continue
+        D, I = index.search(query_vectors, k, params=search_parameters(index, ef_search, nprobe))
+        for row, (row_distances, row_ids) in enumerate(zip(D, I)):
+            hits_per_query[row].extend(
+                (grp, int(faiss_id), float(similarity))
+                for similarity, faiss_id in zip(row_distances, row_ids) if faiss_id >= 0
+            )
+
+    # Best k across groups, without sorting every candidate
+    return [heapq.nlargest(k, hits, key=lambda hit: hit[2]) for hits in hits_per_query]
+
+
+def _fuse(vector_hits, lexical_hits, k):
+    """
+    Reciprocal rank fusion of one query's vector and BM25 rankings. The fused score becomes
+    `score`; the similarity and BM25 score are kept as `vector_score` / `bm25_score`.
+    """
+    fused = {}
+    for field, hits in (("vector_score", vector_hits), ("bm25_score", lexical_hits)):
+        for rank, (grp, faiss_id, score) in enumerate(hits):
+            entry = fused.setdefault((chunk_store.group_key(grp), faiss_id), [grp, faiss_id, {"score": 0.0}])
+            entry[2]["score"] += 1.0 / (RRF_K + rank + 1)
+            entry[2][field] = round(score, 4)
+
+    best = heapq.nlargest(k, fused.values(), key=lambda entry: entry[2]["score"])
+    for _, _, fields in best:
+        fields["score"] = round(fields["score"], 6)
+    return [tuple(entry) for entry in best]
+
+
+def _search(queries, k, group=None, groups=None, ef_search=None, nprobe=None):
+    """
+    Best k chunks for each query. With HYBRID_SEARCH the vector ranking (of the query as
+    typed) is fused with a BM25 ranking (of the keyword-expanded query); otherwise the
+    expanded query is embedded and searched alone.
+    """
+    if not HYBRID_SEARCH:
+        vector_hits = _vector_hits(
+            encode_queries([expand_query_with_keywords(q) for q in queries]), k, group, groups, ef_search, nprobe
+        )
+        return _chunk_hits([
+            [(grp, faiss_id, {"score": round(similarity, 4)}) for grp, faiss_id, similarity in hits]
+            for hits in vector_hits
+        ])
+
+    vector_hits = _vector_hits(encode_queries(queries), k, group, groups, ef_search, nprobe)
+    target_groups = _target_groups(group, groups)
+    return _chunk_hits([
+        _fuse(hits, lexical_index.search(target_groups, expand_query_with_keywords(query), k), k)
+        for query, hits in zip(queries, vector_hits)
+    ])
+
+
+def retrieve_similar_chunks(query: str, k: int = 5, group: str = None, groups: list = None,
+                            ef_search: int = None, nprobe: int = None):
+    """
+    Search FAISS index(es) by cosine similarity, `score` is higher-is-better (cosine in
+    [-1, 1], or the RRF score of the vector and BM25 rankings with HYBRID_SEARCH).
+    If group is provided, search only in that group's own index
+    (exact, group-scoped results). Otherwise search all groups, or only `groups` if given,
+    and merge results. With GLOBAL_INDEX_ENABLED that is a single query on the global index.
+    `ef_search` / `nprobe` override the recall/speed trade-off of HNSW / IVF-PQ group indexes.
+    """
+    return _search([query], k, group, groups, ef_search, nprobe)[0]
+
+
+def retrieve_similar_chunks_batch(queries: list, k: int = 5, group: str = None, groups: list = None,
+                                  ef_search: int = None, nprobe: int = None):
+    """
+    retrieve_similar_chunks for several queries: one batched encode and one multi-vector
+    search per index. Returns one result list per query.
+    """
+    if not queries:
+        return []
+    return _search(queries, k, group, groups, ef_search, nprobe)
+
+
+def aggregate_candidates(chunks, n, aggregation=CANDIDATE_AGGREGATION, chunks_per_candidate=CANDIDATE_CHUNKS):
+    """
+    Group chunks (best first) by CV and return the best chunks of the top `n` CVs, ordered by
+    candidate. Each chunk gets the `candidate_score` of its CV: the max or the sum of its chunk
+    scores, or its reciprocal rank fusion score over the chunk ranking.
+    """
+    if aggregation not in ("max", "sum", "rrf"):
+        raise ValueError(f"Unknown candidate aggregation '{aggregation}'")
+
+    candidates = {}
+    for rank, chunk in enumerate(chunks):
+        key = (chunk.get("group"), chunk["source_file"])
+        candidate = candidates.setdefault(key, {"score": 0.0 if aggregation != "max" else chunk["score"], "chunks": []})
+        if aggregation == "sum":
+            candidate["score"] += chunk["score"]
+        elif aggregation == "rrf":
+            candidate["score"] += 1.0 / (RRF_K + rank + 1)
+        candidate["chunks"].append(chunk)
+
+    results = []
+    for candidate in heapq.nlargest(n, candidates.values(), key=lambda c: c["score"]):
+        for chunk in candidate["chunks"][:chunks_per_candidate]:
+            chunk["candidate_score"] = round(candidate["score"], 4)
+            results.append(chunk)
+    return results
+
+
+def retrieve_candidates(query: str, n: int = 5, group: str = None, groups: list = None,
+                        aggregation: str = CANDIDATE_AGGREGATION, chunks_per_candidate: int = CANDIDATE_CHUNKS,
+                        **search_options):
+    """
+    Candidate-level retrieval: over-fetch chunks, then keep the top `n` distinct CVs with
+    their best `chunks_per_candidate` chunks each.
+    """
+    chunks = retrieve_similar_chunks(query, k=n * CANDIDATE_OVERFETCH, group=group, groups=groups, **search_options)
+    return aggregate_candidates(chunks, n, aggregation, chunks_per_candidate)
+
+
+def retrieve_for_prompt(query: str, k: int = 5, group: str = None, groups: list = None, **search_options):
+    """
+    Retrieve context for an LLM prompt according to RETRIEVAL_MODE: `k` candidates or `k` chunks.
+    """
+    if RETRIEVAL_MODE == "candidate":
+        return retrieve_candidates(query, n=k, group=group, groups=groups, **search_options)
+    return retrieve_similar_chunks(query, k=k, group=group, groups=groups, **search_options)
 
-    # Sort results across groups and return top k
-    sorted_results = sorted(all_results, key=lambda x: x["score"])[:k]
-    return sorted_results
 
+def retrieve_candidates_batch(queries: list, n: int = 5, group: str = None, groups: list = None,
+                              aggregation: str = CANDIDATE_AGGREGATION, chunks_per_candidate: int = CANDIDATE_CHUNKS,
+                              **search_options):
+    chunks_per_query = retrieve_similar_chunks_batch(
+        queries, k=n * CANDIDATE_OVERFETCH, group=group, groups=groups, **search_options
+    )
+    return [aggregate_candidates(chunks, n, aggregation, chunks_per_candidate) for chunks in chunks_per_query]
+
+
+def retrieve_for_prompt_batch(queries: list, k: int = 5, group: str = None, groups: list = None, **search_options):
+    """
+    retrieve_for_prompt for several queries at once, returns one result list per query.
+    """
+    if RETRIEVAL_MODE == "candidate":
+        return retrieve_candidates_batch(queries, n=k, group=group, groups=groups, **search_options)
+    return retrieve_similar_chunks_batch(queries, k=k, group=group, groups=groups, **search_options)
@@ -0,0 +1,59 @@
+import os
+import logging
+import threading
+
+# Encoding used to count prompt tokens, defaults to the one of LLM_MODEL
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING")
+# Characters per token when tiktoken is not available
+APPROX_CHARS_PER_TOKEN = 4
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def get_encoding():
+    """
+    Return the tiktoken encoding for the configured model, or None if tiktoken (or its
+    BPE file) is unavailable, in which case token counts are approximated.
+    """
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    if TOKENIZER_ENCODING:
+                        _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+                    else:
+                        from utils.llm_client import LLM_MODEL
+                        try:
+                            _encoding = tiktoken.encoding_for_model(LLM_MODEL)
+                        except KeyError:
+                            _encoding = tiktoken.get_encoding("o200k_base")
+                except ImportError:
+                    logging.warning("tiktoken is not installed, approximating token counts")
+                except Exception:
+                    logging.warning("Could not load the tiktoken encoding, approximating token counts", exc_info=True)
+                _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = get_encoding()
+    if encoding is None:
+        return (len(text) + APPROX_CHARS_PER_TOKEN - 1) // APPROX_CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Return the longest prefix of `text` that fits in `max_tokens` tokens.
+    """
+    if max_tokens <= 0:
+        return ""
+    encoding = get_encoding()
+    if encoding is None:
+        return text[:max_tokens * APPROX_CHARS_PER_TOKEN]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
@@ -0,0 +1,117 @@
+import io
+import os
+import time
+import hashlib
+import tempfile
+from flask import Request, current_app
+
+# Bytes copied per step when an upload has to be copied into the upload folder
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+# Partial uploads older than this (seconds) are left over from a crashed worker
+PARTIAL_UPLOAD_MAX_AGE = 3600
+
+_PARTIAL_PREFIX = ".upload-"
+_PARTIAL_SUFFIX = ".part"
+
+
+class HashingFile:
+    """
+    File in `directory` that computes the sha256 of everything written to it, so an upload is
+    written to disk once, next to its final name, and its hash is known as soon as its last
+    chunk arrives. Deleted on close unless `persist` moved it to its final name.
+    """
+
+    def __init__(self, directory):
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix=_PARTIAL_PREFIX, suffix=_PARTIAL_SUFFIX)
+        self.file = os.fdopen(fd, "w+b")
+        self.size = 0
+        self.persisted = False
+        self._digest = hashlib.sha256()
+
+    def write(self, data):
+        self._digest.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    @property
+    def sha256(self):
+        return self._digest.hexdigest()
+
+    def persist(self, filepath):
+        """
+        Move the file to `filepath` (a rename within the upload folder, no copy).
+        """
+        self.file.flush()
+        os.replace(self.path, filepath)
+        self.path = filepath
+        self.persisted = True
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+        if not self.persisted:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def __getattr__(self, name):
+        # read/seek/tell etc. of the underlying file, for FileStorage
+        return getattr(self.file, name)
+
+    def __del__(self):
+        # A request aborted mid-body never hands its parts to FileStorage, which would close them
+        if "file" in self.__dict__:
+            self.close()
+
+
+def spool_upload(stream, directory, chunk_size=UPLOAD_CHUNK_SIZE):
+    """
+    Return a HashingFile in `directory` with the content of an upload `stream`. Streams
+    already written there by StreamingUploadRequest are returned as they are; others are
+    copied chunk by chunk, never holding the whole file in memory.
+    """
+    if isinstance(stream, HashingFile) and os.path.dirname(stream.path) == os.path.abspath(directory):
+        return stream
+
+    spool = HashingFile(directory)
+    try:
+        for chunk in iter(lambda: stream.read(chunk_size), b""):
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    return spool
+
+
+def remove_partial_uploads(directory, max_age=PARTIAL_UPLOAD_MAX_AGE):
+    """
+    Delete partial uploads left in `directory` by a worker that was killed mid-request.
+    Recent ones may belong to a request another worker is still receiving and are kept.
+    """
+    if not os.path.isdir(directory):
+        return
+    now = time.time()
+    for name in os.listdir(directory):
+        if not (name.startswith(_PARTIAL_PREFIX) and name.endswith(_PARTIAL_SUFFIX)):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class StreamingUploadRequest(Request):
+    """
+    Flask request class that has the multipart parser write uploaded files straight to their
+    destination instead of a temporary file: into the upload folder, hashed on the way, for
+    the endpoints in app.config["DISK_UPLOAD_ENDPOINTS"], and into memory for all others, so
+    JDs never touch disk. Both are bounded by MAX_CONTENT_LENGTH.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint in current_app.config.get("DISK_UPLOAD_ENDPOINTS", ()):
+            return HashingFile(current_app.config["UPLOAD_FOLDER"])
+        return io.BytesIO()